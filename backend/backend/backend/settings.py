@@ -1,4 +1,6 @@
 import os
+import tempfile
+from datetime import timedelta
 
 from dotenv import load_dotenv
 
@@ -31,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,6 +74,56 @@ DATABASES = {
     }
 }
 
+# Кэш общий для всех процессов: версии справочников, которые меняют
+# команды manage.py (import_csv, update_recipe_scores), и блокировки
+# single-flight должны быть видны воркерам gunicorn. С LocMemCache
+# у каждого процесса свой кэш, и после import_csv воркеры отдают
+# старые данные до истечения REFERENCE_CACHE_TIMEOUT.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='core.cache.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram-cache')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default=10000)),
+        },
+    }
+}
+
+REFERENCE_CACHE_TIMEOUT = int(
+    os.getenv('REFERENCE_CACHE_TIMEOUT', default=24 * 60 * 60)
+)
+
+RECIPE_FEED_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_FEED_CACHE_TIMEOUT', default=5 * 60)
+)
+
+# Лента подписок: сколько рецептов хранится у каждого пользователя и
+# начиная с какого числа подписчиков рецепты автора подмешиваются при
+# чтении, а не раскладываются по лентам.
+FEED_TIMELINE_SIZE = int(os.getenv('FEED_TIMELINE_SIZE', default=500))
+FEED_FANOUT_MAX_FOLLOWERS = int(
+    os.getenv('FEED_FANOUT_MAX_FOLLOWERS', default=1000)
+)
+
+# Периоды полураспада вклада избранного и корзины в рейтинги
+# ?ordering=popular и ?ordering=trending.
+POPULAR_HALF_LIFE = timedelta(
+    days=float(os.getenv('POPULAR_HALF_LIFE_DAYS', default=30))
+)
+TRENDING_HALF_LIFE = timedelta(
+    hours=float(os.getenv('TRENDING_HALF_LIFE_HOURS', default=24))
+)
+
+SIMILAR_RECIPES_COUNT = int(os.getenv('SIMILAR_RECIPES_COUNT', default=10))
+
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', default='russian')
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -140,3 +193,47 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+INSTRUMENTATION_ENABLED = os.getenv(
+    'INSTRUMENTATION_ENABLED', default='True'
+) == 'True'
+# Сколько одинаковых по форме SQL за запрос считать признаком N+1.
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', default=10))
+
+# Построчный лог запросов (INFO) включается в развёртывании; по умолчанию
+# только предупреждения N+1, чтобы не засорять вывод тестов и команд.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.instrumentation': {
+            'handlers': ['console'],
+            'level': os.getenv('INSTRUMENTATION_LOG_LEVEL', default='WARNING'),
+        },
+    },
+}
+
+# Наибольшая сторона WebP-копий изображений рецептов, px.
+RECIPE_IMAGE_VARIANTS = {'small': 320, 'medium': 960}
+
+# Ограничения на загружаемое изображение рецепта; больше - ответ 413.
+RECIPE_IMAGE_MAX_BYTES = int(
+    os.getenv('RECIPE_IMAGE_MAX_BYTES', default=10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = int(
+    os.getenv('RECIPE_IMAGE_MAX_PIXELS', default=5000 * 5000)
+)
+# Base64 длиннее файла на треть, плюс запас на остальные поля рецепта.
+RECIPE_REQUEST_MAX_BYTES = RECIPE_IMAGE_MAX_BYTES * 4 // 3 + 1024 * 1024
+
+# Потоки для обработки изображений и пересчёта похожих рецептов;
+# 0 - выполнять сразу после коммита, без фонового пула.
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', default=2))
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import include, path
 
+from core.instrumentation import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/_metrics', MetricsView.as_view(), name='metrics'),
     path('api/', include('users.urls')),
     path('api/', include('recipes.urls'))
 ]
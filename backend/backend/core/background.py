@@ -0,0 +1,44 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _run(task, args):
+    # Коммит уже прошёл: ошибка задачи не должна превращаться в 500.
+    try:
+        task(*args)
+    except Exception:
+        logger.exception('Background task %s%r failed', task.__name__, args)
+
+
+def _run_in_thread(task, args):
+    try:
+        _run(task, args)
+    finally:
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BACKGROUND_WORKERS,
+            thread_name_prefix='background'
+        )
+    return _executor
+
+
+def run_after_commit(task, *args):
+    """Запускает task(*args) после коммита в фоновом пуле потоков."""
+    if not settings.BACKGROUND_WORKERS:
+        transaction.on_commit(lambda: _run(task, args))
+        return
+    transaction.on_commit(
+        lambda: _get_executor().submit(_run_in_thread, task, args)
+    )
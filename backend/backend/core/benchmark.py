@@ -0,0 +1,358 @@
+"""
+Нагрузочные замеры горячих путей API через тестовый клиент DRF.
+
+Данные генерируются детерминированно по seed, замеры идут через
+настоящие view, так что в них попадают сериализаторы, пагинация
+и middleware.
+"""
+import base64
+import random
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from core.cache import bump_version
+from core.ranking import update_scores
+from core.similarity import build_similar_recipes
+from core.utils import rebuild_shopping_lists, recount_recipe_counters
+from recipes.models import (
+    Cart, Favorite, Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag,
+    TimelineEntry
+)
+from users.models import Follow, User
+
+PREFIX = 'bench'
+# Без совпадения этих полей meta сравнивать время бессмысленно.
+TIMING_META = ('database', 'python')
+IMAGE = 'data:image/gif;base64,' + base64.b64encode(
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00\x00!\xf9\x04'
+    b'\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D'
+    b'\x01\x00;'
+).decode()
+
+
+def generate_data(users, recipes, ingredients, follows, seed=0,
+                  cart_recipes=1000):
+    """
+    Пользователи, ингредиенты, рецепты, подписки, избранное, корзины.
+
+    У последнего пользователя в корзине cart_recipes рецептов - для
+    замера выгрузки большого списка покупок.
+    """
+    rng = random.Random(seed)
+    batch_size = None if connection.vendor == 'sqlite' else 2000
+    password = make_password(PREFIX)
+    User.objects.bulk_create((
+        User(
+            username=f'{PREFIX}{i}', email=f'{PREFIX}{i}@example.com',
+            first_name='Bench', last_name=str(i), password=password
+        ) for i in range(users)
+    ), batch_size=batch_size)
+    user_ids = list(User.objects.filter(
+        username__startswith=PREFIX
+    ).values_list('pk', flat=True))
+    Tag.objects.bulk_create((
+        Tag(name=f'{PREFIX}{i}', slug=f'{PREFIX}{i}', color='green')
+        for i in range(3)
+    ))
+    tag_ids = list(Tag.objects.filter(
+        slug__startswith=PREFIX
+    ).values_list('pk', flat=True))
+    Ingredient.objects.bulk_create((
+        Ingredient(
+            name=f'{PREFIX} ингредиент {i}', measurement_unit='г',
+            kcal=i % 900, protein=i % 30, fat=i % 50, carbs=i % 80,
+            price=i % 1000
+        ) for i in range(ingredients)
+    ), batch_size=batch_size, ignore_conflicts=True)
+    ingredient_ids = list(Ingredient.objects.filter(
+        name__startswith=PREFIX
+    ).values_list('pk', flat=True))
+    Recipe.objects.bulk_create((
+        Recipe(
+            name=f'{PREFIX} рецепт {i}', author_id=rng.choice(user_ids),
+            text='Описание рецепта для замеров', cooking_time=30,
+            image='bench.gif'
+        ) for i in range(recipes)
+    ), batch_size=batch_size)
+    recipe_ids = list(Recipe.objects.filter(
+        name__startswith=PREFIX
+    ).values_list('pk', flat=True))
+    RecipeTag.objects.bulk_create((
+        RecipeTag(recipe_id=recipe, tag_id=tag)
+        for recipe in recipe_ids
+        for tag in rng.sample(tag_ids, rng.randint(1, len(tag_ids)))
+    ), batch_size=batch_size)
+    RecipeIngredient.objects.bulk_create((
+        RecipeIngredient(recipe_id=recipe, ingredient_id=ingredient,
+                         amount=rng.randint(1, 500))
+        for recipe in recipe_ids
+        for ingredient in rng.sample(ingredient_ids, 8)
+    ), batch_size=batch_size)
+    Follow.objects.bulk_create((
+        Follow(user_id=user, author_id=author)
+        for user in user_ids
+        for author in rng.sample(user_ids, min(follows, len(user_ids)))
+        if author != user
+    ), batch_size=batch_size)
+    _fill_timelines(user_ids, batch_size)
+    for model in (Favorite, Cart):
+        model.objects.bulk_create((
+            model(user_id=user, recipe_id=recipe)
+            for user in user_ids
+            for recipe in rng.sample(recipe_ids, min(10, len(recipe_ids)))
+        ), batch_size=batch_size)
+    Cart.objects.bulk_create((
+        Cart(user_id=user_ids[-1], recipe_id=recipe)
+        for recipe in recipe_ids[:cart_recipes]
+    ), batch_size=batch_size, ignore_conflicts=True)
+    recount_recipe_counters()
+    update_scores()
+    rebuild_shopping_lists(user_ids)
+    Recipe.objects.filter(pk__in=recipe_ids).update_derived_fields()
+    build_similar_recipes()
+    return user_ids, recipe_ids, ingredient_ids
+
+
+def _fill_timelines(user_ids, batch_size):
+    """Ленты подписок, как если бы рецепты публиковались через API."""
+    recipes = defaultdict(list)
+    for pk, author, pub_date in Recipe.objects.filter(
+        author__in=user_ids
+    ).values_list('pk', 'author_id', 'pub_date'):
+        recipes[author].append((pub_date, pk))
+    timelines = defaultdict(list)
+    for user, author in Follow.objects.filter(
+        user__in=user_ids
+    ).values_list('user_id', 'author_id'):
+        timelines[user].extend(recipes[author])
+    TimelineEntry.objects.bulk_create((
+        TimelineEntry(user_id=user, recipe_id=pk, pub_date=pub_date)
+        for user, entries in timelines.items()
+        for pub_date, pk in sorted(entries, reverse=True)[
+            :settings.FEED_TIMELINE_SIZE
+        ]
+    ), batch_size=batch_size)
+    Recipe.objects.filter(author__in=user_ids).update(fanned_out=True)
+
+
+class Scenario:
+    """
+    Запрос для замера: make_request(client, state). client - один из
+    клиентов run(): anonymous, authenticated или large_cart.
+    """
+
+    def __init__(self, name, make_request, client='authenticated'):
+        self.name = name
+        self.make_request = make_request
+        self.client = client
+
+
+def _uncached_list(client, state):
+    """Анонимная лента мимо кэша ответов: как после изменения рецепта."""
+    bump_version('recipes')
+    return client.get('/api/recipes/?limit=6')
+
+
+def _download(client, state):
+    return b''.join(client.get(
+        '/api/recipes/download_shopping_cart/'
+    ).streaming_content)
+
+
+def _recipe_payload(state):
+    state['counter'] += 1
+    return {
+        'name': f"{PREFIX} новый рецепт {state['counter']}",
+        'text': 'Рецепт из замеров',
+        'cooking_time': 10,
+        'image': IMAGE,
+        'tags': state['tags'][:2],
+        'ingredients': [
+            {'id': ingredient, 'amount': state['counter'] % 50 + 1}
+            for ingredient in state['rng'].sample(state['ingredients'], 10)
+        ],
+    }
+
+
+SCENARIOS = (
+    Scenario(
+        'recipes_list_anonymous',
+        lambda client, state: client.get('/api/recipes/?limit=6'),
+        client='anonymous'
+    ),
+    Scenario(
+        'recipes_list_anonymous_uncached', _uncached_list, client='anonymous'
+    ),
+    Scenario(
+        'recipes_list_authenticated',
+        lambda client, state: client.get('/api/recipes/?limit=6')
+    ),
+    Scenario(
+        'recipes_list_trending',
+        lambda client, state: client.get(
+            '/api/recipes/?limit=6&ordering=trending'
+        )
+    ),
+    Scenario(
+        'recipes_list_page_100',
+        lambda client, state: client.get('/api/recipes/?limit=100')
+    ),
+    Scenario(
+        'recipe_detail',
+        lambda client, state: client.get(
+            f"/api/recipes/{state['rng'].choice(state['recipes'])}/"
+        )
+    ),
+    Scenario(
+        'recipe_similar',
+        lambda client, state: client.get(
+            f"/api/recipes/{state['rng'].choice(state['recipes'])}/similar/"
+        )
+    ),
+    Scenario(
+        'recipe_create',
+        lambda client, state: client.post(
+            '/api/recipes/', _recipe_payload(state), format='json'
+        )
+    ),
+    Scenario(
+        'recipe_update',
+        lambda client, state: client.patch(
+            f"/api/recipes/{state['own_recipe']}/",
+            dict(_recipe_payload(state), name=f'{PREFIX} изменяемый'),
+            format='json'
+        )
+    ),
+    Scenario(
+        'recipes_feed',
+        lambda client, state: client.get('/api/recipes/feed/?limit=6')
+    ),
+    Scenario(
+        'subscriptions',
+        lambda client, state: client.get(
+            '/api/users/subscriptions/?limit=6&recipes_limit=3'
+        )
+    ),
+    Scenario('download_shopping_cart', _download),
+    Scenario('download_shopping_cart_large', _download, client='large_cart'),
+    Scenario(
+        'ingredient_search',
+        lambda client, state: client.get(
+            f"/api/ingredients/autocomplete/?name={PREFIX}%20ингредиент%20"
+            f"{state['rng'].randint(1, 99)}"
+        )
+    ),
+)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def measure(scenario, client, state, iterations, warmup=3):
+    """Задержки p50/p99, запросы к базе и пик выделенной памяти."""
+    for _ in range(warmup):
+        scenario.make_request(client, state)
+    timings, queries = [], []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            scenario.make_request(client, state)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(context.captured_queries))
+    # tracemalloc сильно замедляет запросы, поэтому память меряется
+    # отдельным коротким прогоном.
+    peaks = []
+    for _ in range(min(iterations, 5)):
+        tracemalloc.start()
+        scenario.make_request(client, state)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+    return {
+        'p50_ms': round(statistics.median(timings), 2),
+        'p99_ms': round(_percentile(timings, 99), 2),
+        'mean_ms': round(statistics.mean(timings), 2),
+        'queries': max(queries),
+        'alloc_peak_kib': round(statistics.median(peaks), 1),
+    }
+
+
+def run(scenarios, iterations, user_ids, recipe_ids, ingredient_ids,
+        seed=0):
+    rng = random.Random(seed)
+    user = User.objects.get(pk=user_ids[0])
+    own_recipe = Recipe.objects.filter(author=user).first()
+    if own_recipe is None:
+        own_recipe = Recipe.objects.filter(pk__in=recipe_ids).first()
+        user = own_recipe.author
+    state = {
+        'rng': rng,
+        'counter': 0,
+        'recipes': recipe_ids,
+        'ingredients': ingredient_ids,
+        'tags': list(Tag.objects.filter(
+            slug__startswith=PREFIX
+        ).values_list('pk', flat=True)),
+        'own_recipe': own_recipe.pk,
+    }
+    clients = {
+        'anonymous': APIClient(),
+        'authenticated': APIClient(),
+        'large_cart': APIClient(),
+    }
+    clients['authenticated'].force_authenticate(user)
+    clients['large_cart'].force_authenticate(
+        User.objects.get(pk=user_ids[-1])
+    )
+    results = {}
+    for scenario in scenarios:
+        results[scenario.name] = measure(
+            scenario, clients[scenario.client], state, iterations
+        )
+    return results
+
+
+def compare(report, baseline, tolerance=None):
+    """
+    Список регрессий относительно сохранённого прогона. Число запросов
+    сравнивается всегда, p50 - только с tolerance: время на другой базе
+    или версии Python несравнимо, и тогда ValueError.
+    """
+    if tolerance is not None:
+        mismatched = [
+            name for name in TIMING_META
+            if baseline['meta'].get(name) != report['meta'][name]
+        ]
+        if mismatched:
+            raise ValueError(
+                'Timings are not comparable, baseline has different '
+                + ', '.join(mismatched)
+            )
+    regressions = []
+    for name, current in report['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries']:
+            regressions.append(
+                f"{name}: queries {previous['queries']} -> "
+                f"{current['queries']}"
+            )
+        if tolerance is None:
+            continue
+        if current['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p50 {previous['p50_ms']} ms -> "
+                f"{current['p50_ms']} ms"
+            )
+    return regressions
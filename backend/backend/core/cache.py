@@ -0,0 +1,130 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends import filebased
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+VERSION_KEY = '{namespace}:{name}:version'
+PAYLOAD_KEY = '{namespace}:{name}:{version}:{variant}'
+# Ответы ленты рецептов - не справочник, их ключи отдельно.
+NAMESPACES = {'recipes': 'feed'}
+
+# Сколько ждать, пока другой запрос строит то же значение, и как часто
+# проверять кэш. Если он не успел, строим сами.
+SINGLE_FLIGHT_TIMEOUT = 10
+SINGLE_FLIGHT_POLL = 0.05
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """
+    Файловый кэш с атомарным add(): на нём держится single-flight
+    между процессами. В Django add() - это has_key() и set(), и
+    одновременные промахи в разных воркерах строят значение каждый.
+    """
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._createdir()
+        self._cull()
+        fname = self._key_to_file(key, version)
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+        try:
+            with open(fd, 'wb') as f:
+                self._write_content(f, timeout, value)
+            # link() не перезаписывает существующий файл. Истёкшую
+            # запись has_key() удаляет, после неё пробуем ещё раз.
+            for _ in range(2):
+                try:
+                    os.link(tmp_path, fname)
+                    return True
+                except FileExistsError:
+                    if self.has_key(key, version):
+                        return False
+            return False
+        finally:
+            os.remove(tmp_path)
+
+
+def _new_version():
+    # Версия от времени, чтобы после очистки кэша не совпасть со старой.
+    return int(time.time() * 1000)
+
+
+def _namespace(name):
+    return NAMESPACES.get(name, 'reference')
+
+
+def get_version(name):
+    key = VERSION_KEY.format(namespace=_namespace(name), name=name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Делает закэшированные данные name неактуальными."""
+    key = VERSION_KEY.format(namespace=_namespace(name), name=name)
+    try:
+        cache.incr(key)
+        # incr() не у всех бэкендов сохраняет бессрочный timeout.
+        cache.touch(key, timeout=None)
+    except ValueError:
+        cache.set(key, _new_version(), timeout=None)
+
+
+def _wait_for(key):
+    deadline = time.monotonic() + SINGLE_FLIGHT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return None
+
+
+def get_or_build(key, build, timeout):
+    """
+    cache.get с построением при промахе. Одновременные промахи по
+    одному ключу ждут первый запрос, а не строят значение каждый сам.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+    lock = f'{key}:lock'
+    acquired = cache.add(lock, 1, timeout=SINGLE_FLIGHT_TIMEOUT)
+    if not acquired:
+        value = _wait_for(key)
+        if value is not None:
+            return value
+    try:
+        value = build()
+        cache.set(key, value, timeout=timeout)
+        return value
+    finally:
+        if acquired:
+            cache.delete(lock)
+
+
+def get_cached_json(name, build, variant='', timeout=None):
+    """
+    Готовый JSON и его ETag для текущей версии данных name.
+
+    build() вызывается только при промахе и должен вернуть bytes;
+    variant отличает разные ответы по одним данным.
+    """
+    def build_with_etag():
+        payload = build()
+        return payload, '"{}"'.format(hashlib.md5(payload).hexdigest())
+
+    key = PAYLOAD_KEY.format(
+        namespace=_namespace(name), name=name, version=get_version(name),
+        variant=variant
+    )
+    if timeout is None:
+        timeout = settings.REFERENCE_CACHE_TIMEOUT
+    return get_or_build(key, build_with_etag, timeout)
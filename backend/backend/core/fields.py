@@ -0,0 +1,92 @@
+import base64
+import binascii
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from drf_extra_fields.fields import Base64FieldMixin, Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+from .exceptions import PayloadTooLarge
+
+# Кратно 4, чтобы каждый кусок base64 декодировался отдельно.
+BASE64_CHUNK_SIZE = 64 * 1024
+# Пробельные символы ASCII, которые пропускал и b64decode целиком.
+BASE64_WHITESPACE = str.maketrans('', '', ' \t\r\n\f\v')
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Ссылки на копии изображения рецепта, абсолютные при наличии request."""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        if request is None:
+            return value
+        return {
+            variant: request.build_absolute_uri(url)
+            for variant, url in value.items()
+        }
+
+
+class LimitedBase64ImageField(Base64ImageField):
+    """
+    Изображение строкой base64 или файлом из multipart-запроса.
+
+    Base64 декодируется по частям во временный файл. Размер файла и
+    число пикселей проверяются до полного декодирования картинки,
+    при превышении - ответ 413.
+    """
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if isinstance(data, str):
+            data = self._decode_to_file(data)
+        elif not isinstance(data, UploadedFile):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        extension = self._check_limits(data)
+        if extension not in self.ALLOWED_TYPES:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        if not data.name or '.' not in data.name:
+            data.name = f'{uuid.uuid4()}.{extension}'
+        return super(Base64FieldMixin, self).to_internal_value(data)
+
+    def _decode_to_file(self, data):
+        data = data.rpartition(';base64,')[2]
+        # Убираются до нарезки, иначе куски сместятся относительно
+        # четвёрок символов base64.
+        data = data.translate(BASE64_WHITESPACE)
+        size = len(data) * 3 // 4 - data[-2:].count('=')
+        if size > settings.RECIPE_IMAGE_MAX_BYTES:
+            raise PayloadTooLarge('Изображение слишком большое.')
+        upload = TemporaryUploadedFile('', None, size, None)
+        try:
+            for start in range(0, len(data), BASE64_CHUNK_SIZE):
+                upload.write(base64.b64decode(
+                    data[start:start + BASE64_CHUNK_SIZE]
+                ))
+        except (TypeError, binascii.Error, ValueError):
+            upload.close()
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        upload.seek(0)
+        return upload
+
+    def _check_limits(self, upload):
+        """Проверяет ограничения по заголовку файла; возвращает формат."""
+        if upload.size > settings.RECIPE_IMAGE_MAX_BYTES:
+            raise PayloadTooLarge('Изображение слишком большое.')
+        upload.seek(0)
+        try:
+            # Image.open читает только заголовок, пиксели не декодируются.
+            with Image.open(upload) as image:
+                width, height = image.size
+                extension = (image.format or '').lower()
+        except Image.DecompressionBombError:
+            raise PayloadTooLarge('Слишком много пикселей в изображении.')
+        except (OSError, SyntaxError, ValueError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        upload.seek(0)
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            raise PayloadTooLarge('Слишком много пикселей в изображении.')
+        return 'jpg' if extension == 'jpeg' else extension
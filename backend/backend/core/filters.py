@@ -1,6 +1,7 @@
 from django_filters import rest_framework as filters
 
 from recipes.models import Ingredient, Recipe, Tag
+from .ranking import RANKINGS
 
 
 class RecipeFilterMainPage(filters.FilterSet):
@@ -21,11 +22,42 @@ class RecipeFilter(filters.FilterSet):
         queryset=Tag.objects.all(),
         field_name='tags__slug',
         to_field_name='slug',
+        method='filter_tags',
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=(('any', 'any'), ('all', 'all')),
+        method='skip_filter',
     )
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='search_recipes')
+    # Последний в Meta.fields, чтобы перекрыть сортировку поиска.
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in RANKINGS],
+        method='order_by_score',
+    )
+
+    def filter_tags(self, queryset, name, value):
+        # Без тегов приходит пустой queryset, а не пустой список,
+        # поэтому django-filter не пропускает фильтр сам.
+        if not value:
+            return queryset
+        match_all = self.form.cleaned_data.get('tags_mode') == 'all'
+        return queryset.with_tags(value, match_all=match_all)
+
+    def skip_filter(self, queryset, name, value):
+        return queryset
+
+    def search_recipes(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return queryset.search(value)
+
+    def order_by_score(self, queryset, name, value):
+        return queryset.order_by(f'-{RANKINGS[value]}', '-id')
 
     def get_is_favorited(self, queryset, name, value):
         if value:
@@ -43,7 +75,10 @@ class RecipeFilter(filters.FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',)
+        fields = (
+            'tags', 'tags_mode', 'author', 'is_favorited',
+            'is_in_shopping_cart', 'search', 'ordering'
+        )
 
 
 class IngredientFilter(filters.FilterSet):
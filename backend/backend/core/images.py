@@ -0,0 +1,97 @@
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, JpegImagePlugin
+
+from core.background import run_after_commit
+from core.cache import bump_version
+from recipes.models import IMAGE_DIR, Recipe, image_variant_name
+
+WEBP_QUALITY = 80
+# Оригинал только очищается от EXIF, поэтому сжимается почти без потерь.
+ORIGINAL_QUALITY = 95
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def _save_once(name, build):
+    """Сохраняет файл, если его ещё нет: одинаковые загрузки не дублируются."""
+    if not default_storage.exists(name):
+        saved = default_storage.save(name, ContentFile(build()))
+        if saved != name:
+            # Тот же файл параллельно сохранил другой поток.
+            default_storage.delete(saved)
+    return name
+
+
+def _encode(image, format, **options):
+    buffer = io.BytesIO()
+    # EXIF и прочие метаданные не передаются, поэтому в файл не попадают.
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def _original_options(source, format):
+    """Параметры пересохранения оригинала без заметной потери качества."""
+    if format == 'JPEG':
+        # Таблицы квантования исходника, как quality='keep', но
+        # применимо и к повёрнутому exif_transpose изображению.
+        return {
+            'qtables': source.quantization,
+            'subsampling': JpegImagePlugin.get_sampling(source),
+        }
+    if format == 'WEBP':
+        return {'quality': ORIGINAL_QUALITY}
+    return {}
+
+
+def _variant(image, size):
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    return _encode(image, 'WEBP', quality=WEBP_QUALITY, method=4)
+
+
+def process_recipe_image(recipe_id):
+    """
+    Пересохраняет изображение рецепта под именем из хеша содержимого
+    без EXIF и строит WebP-копии из RECIPE_IMAGE_VARIANTS.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return
+    uploaded = recipe.image.name
+    with recipe.image.open('rb') as f:
+        data = f.read()
+    image_hash = hashlib.sha256(data).hexdigest()
+    with Image.open(io.BytesIO(data)) as source:
+        format = source.format if source.format in EXTENSIONS else 'PNG'
+        options = _original_options(source, format)
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    original = _save_once(
+        f'{IMAGE_DIR}/{image_hash[:2]}/{image_hash}.{EXTENSIONS[format]}',
+        lambda: _encode(image, format, **options)
+    )
+    for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        _save_once(
+            image_variant_name(image_hash, variant),
+            lambda: _variant(image, size)
+        )
+    # Если пока шла обработка загрузили новое изображение, его не трогаем.
+    updated = Recipe.objects.filter(pk=recipe_id, image=uploaded).update(
+        image=original, image_hash=image_hash
+    )
+    if updated:
+        bump_version('recipes')
+    if (updated and uploaded != original
+            and not Recipe.objects.filter(image=uploaded).exists()):
+        default_storage.delete(uploaded)
+
+
+def schedule_image_processing(recipe_id):
+    """Обработка изображения после коммита, в фоновом пуле потоков."""
+    run_after_commit(process_recipe_image, recipe_id)
@@ -0,0 +1,225 @@
+"""
+Счётчики запросов к базе, времени и размера ответа по каждому
+view/action.
+
+Данные отдаются в заголовке Server-Timing, в лог core.instrumentation
+и в формате Prometheus на /api/_metrics. Метрики копятся в памяти
+процесса, поэтому при нескольких воркерах gunicorn у каждого свои.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_lock = threading.Lock()
+_metrics = defaultdict(Counter)
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+METRICS = (
+    ('requests_total', 'counter', 'Requests handled.'),
+    ('db_queries_total', 'counter', 'SQL queries executed.'),
+    ('db_seconds_total', 'counter', 'Time spent in SQL queries.'),
+    ('serializer_seconds_total', 'counter', 'Time spent serializing.'),
+    ('response_seconds_total', 'counter', 'Time spent in the view.'),
+    ('response_bytes_total', 'counter', 'Response body size.'),
+    ('n_plus_one_total', 'counter', 'Requests with repeated SQL shapes.'),
+)
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.shapes = Counter()
+
+
+def current_stats():
+    return getattr(_local, 'stats', None)
+
+
+def sql_shape(sql):
+    """SQL без значений: списки IN и числа схлопываются."""
+    return NUMBER.sub('?', IN_LIST.sub('IN (...)', sql))
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = current_stats()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - start
+        stats.queries += 1
+        stats.shapes[sql_shape(sql)] += 1
+
+
+def _timed_data(data):
+    """Оборачивает BaseSerializer.data, вложенные вызовы не считаются."""
+
+    def wrapper(serializer):
+        stats = current_stats()
+        if stats is None:
+            return data.fget(serializer)
+        stats.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            stats.serializer_depth -= 1
+            if not stats.serializer_depth:
+                stats.serializer_time += time.perf_counter() - start
+
+    return property(wrapper)
+
+
+def instrument_serializers():
+    """Вызывается один раз из CoreConfig.ready."""
+    base = serializers.BaseSerializer
+    if not getattr(base.data, 'instrumented', False):
+        base.data = _timed_data(base.data)
+        base.data.fget.instrumented = True
+
+
+def _view_name(request, view_func):
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return getattr(view_func, '__name__', 'unknown')
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower())
+    if action is None:
+        return view_class.__name__
+    return f'{view_class.__name__}.{action}'
+
+
+def _response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+
+class InstrumentationMiddleware:
+    """
+    Собирает статистику запроса. Запросы потоковых ответов, которые
+    выполняются уже при отдаче тела, не учитываются.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+        _local.stats = stats = RequestStats()
+        request.instrumentation_view = None
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(_record_query)
+                    )
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        total = time.perf_counter() - start
+        self._report(request, response, stats, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.instrumentation_view = _view_name(request, view_func)
+
+    def _report(self, request, response, stats, total):
+        view = request.instrumentation_view or 'unresolved'
+        size = _response_size(response)
+        repeated = {
+            shape: count for shape, count in stats.shapes.items()
+            if count >= settings.N_PLUS_ONE_THRESHOLD
+        }
+        with _lock:
+            metrics = _metrics[view]
+            metrics['requests_total'] += 1
+            metrics['db_queries_total'] += stats.queries
+            metrics['db_seconds_total'] += stats.db_time
+            metrics['serializer_seconds_total'] += stats.serializer_time
+            metrics['response_seconds_total'] += total
+            metrics['response_bytes_total'] += size
+            metrics['n_plus_one_total'] += bool(repeated)
+        response['Server-Timing'] = (
+            f'db;dur={stats.db_time * 1000:.1f};'
+            f'desc="{stats.queries} queries", '
+            f'serialize;dur={stats.serializer_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+        logger.info(json.dumps({
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 1),
+            'serializer_ms': round(stats.serializer_time * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'bytes': size,
+        }))
+        for shape, count in repeated.items():
+            logger.warning(
+                'Possible N+1 in %s: %d identical queries: %s',
+                view, count, shape
+            )
+
+
+def render_metrics():
+    """Текстовый формат Prometheus."""
+    with _lock:
+        snapshot = {view: dict(values) for view, values in _metrics.items()}
+    lines = []
+    for name, kind, help_text in METRICS:
+        lines.append(f'# HELP foodgram_{name} {help_text}')
+        lines.append(f'# TYPE foodgram_{name} {kind}')
+        for view in sorted(snapshot):
+            value = snapshot[view].get(name, 0)
+            lines.append(f'foodgram_{name}{{view="{view}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = data.get('detail', '')
+        return str(data).encode(self.charset)
+
+
+class MetricsView(APIView):
+    permission_classes = (IsAdminUser, )
+    renderer_classes = (PrometheusRenderer, )
+
+    def get(self, request):
+        return Response(
+            render_metrics(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
@@ -0,0 +1,157 @@
+import json
+import logging
+import platform
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import (
+    override_settings, setup_test_environment, teardown_test_environment
+)
+
+from core.benchmark import SCENARIOS, compare, generate_data, run
+
+
+# Параметры, от которых зависят сгенерированные данные.
+DATA_OPTIONS = (
+    'users', 'recipes', 'ingredients', 'follows', 'cart_recipes', 'seed'
+)
+
+ISOLATED_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    }
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the API hot paths on generated data; '
+        'all changes are rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--ingredients', type=int, default=1000)
+        parser.add_argument('--follows', type=int, default=10)
+        parser.add_argument(
+            '--cart-recipes',
+            type=int,
+            default=1000,
+            help='Recipes in the cart of the large_cart user'
+        )
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=[scenario.name for scenario in SCENARIOS],
+            help='Run only these scenarios; can be repeated'
+        )
+        parser.add_argument('--output', help='Write results to a JSON file')
+        parser.add_argument(
+            '--baseline',
+            help='Fail if results regress against this JSON file'
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Allowed relative p50 slowdown against the baseline'
+        )
+        parser.add_argument(
+            '--queries-only',
+            action='store_true',
+            help='Compare only query counts with the baseline, not timings'
+        )
+
+    def handle(self, *args, **options):
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if not options['scenario'] or scenario.name in options['scenario']
+        ]
+        # Построчный лог запросов только мешает; предупреждения N+1 остаются.
+        logging.getLogger('core.instrumentation').setLevel(logging.WARNING)
+        setup_test_environment()
+        try:
+            # Данные замеров откатываются, и их ответы не должны
+            # остаться в общем кэше приложения.
+            with override_settings(
+                MEDIA_ROOT=tempfile.mkdtemp(), CACHES=ISOLATED_CACHES
+            ):
+                results = self._run(scenarios, options)
+        finally:
+            teardown_test_environment()
+        report = {
+            'meta': {
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                **{
+                    name: options[name]
+                    for name in DATA_OPTIONS + ('iterations',)
+                },
+            },
+            'results': results,
+        }
+        for name, values in results.items():
+            self.stdout.write(
+                f"{name:32} p50 {values['p50_ms']:8.2f} ms  "
+                f"p99 {values['p99_ms']:8.2f} ms  "
+                f"queries {values['queries']:3}  "
+                f"alloc {values['alloc_peak_kib']:9.1f} KiB"
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            # Замеры на других данных сравнивать бессмысленно.
+            mismatched = [
+                name for name in ('database',) + DATA_OPTIONS
+                if baseline['meta'].get(name) != report['meta'][name]
+            ]
+            if mismatched:
+                raise CommandError(
+                    'Baseline was generated with different '
+                    + ', '.join(mismatched)
+                )
+            tolerance = (
+                None if options['queries_only'] else options['tolerance']
+            )
+            try:
+                regressions = compare(report, baseline, tolerance)
+            except ValueError as error:
+                raise CommandError(error)
+            if regressions:
+                raise CommandError(
+                    'Regressions found:\n' + '\n'.join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS('No regressions'))
+
+    def _run(self, scenarios, options):
+        """Генерация данных и замеры в транзакции, которая откатывается."""
+        results = None
+        try:
+            with transaction.atomic():
+                ids = generate_data(
+                    options['users'], options['recipes'],
+                    options['ingredients'], options['follows'],
+                    options['seed'], options['cart_recipes']
+                )
+                results = run(
+                    scenarios, options['iterations'], *ids,
+                    seed=options['seed']
+                )
+                raise Rollback
+        except Rollback:
+            pass
+        return results
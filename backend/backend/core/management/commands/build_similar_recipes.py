@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.similarity import build_similar_recipes
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the top-K similar recipes of every recipe'
+
+    def handle(self, *args, **kwargs):
+        created = build_similar_recipes()
+        self.stdout.write(f'Similar recipes stored: {created}')
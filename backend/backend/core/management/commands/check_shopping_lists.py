@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from core.utils import AMOUNT_EPSILON, get_cart_totals, rebuild_shopping_lists
+from recipes.models import Cart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    """
+    Списки покупок меняются вместе с корзиной (add_recipes,
+    remove_recipes) и составом рецепта (change_in_shopping_lists). Все
+    три блокируют строки затронутых рецептов, поэтому параллельные
+    изменения не расходятся с живым SUM; расхождение здесь - ошибка,
+    а не гонка.
+    """
+    help = 'Compares stored shopping lists with the live cart SUM query'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Rebuild shopping lists of users with mismatches'
+        )
+
+    def handle(self, *args, **options):
+        expected = get_cart_totals(Cart.objects.all())
+        stored = {
+            (user, ingredient): amount
+            for user, ingredient, amount in
+            ShoppingListItem.objects.values_list(
+                'user', 'ingredient', 'amount'
+            ).iterator()
+        }
+        broken_users = set()
+        for key in expected.keys() | stored.keys():
+            difference = expected.get(key, 0) - stored.get(key, 0)
+            if abs(difference) > AMOUNT_EPSILON:
+                user, ingredient = key
+                broken_users.add(user)
+                self.stdout.write(
+                    f'user={user} ingredient={ingredient}: '
+                    f'expected {expected.get(key, 0)}, '
+                    f'stored {stored.get(key, 0)}'
+                )
+        if not broken_users:
+            self.stdout.write(self.style.SUCCESS('Shopping lists are consistent'))
+            return
+        if options['fix']:
+            rebuild_shopping_lists(broken_users)
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt shopping lists of {len(broken_users)} users'
+            ))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f'Mismatches for {len(broken_users)} users'
+            ))
@@ -1,23 +1,262 @@
 import csv
+import io
+import json
 import os
+from itertools import islice
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
-from recipes.models import Ingredient
+from core.cache import bump_version
+from core.units import NUTRITION_FIELDS
+from recipes.models import Ingredient, Recipe, Tag
 
 
 root_path = os.path.dirname(settings.BASE_DIR)
 data_path = os.path.join(root_path, 'data', 'ingredients.csv')
 
+# Рецепты с обновлёнными ингредиентами пересчитываются порциями,
+# чтобы список id в запросе не упирался в лимит параметров SQLite.
+RECIPE_UPDATE_BATCH = 500
+
+# Ключевые поля и поля с данными для каждой загружаемой модели.
+# Пустое значение поля с данными не меняет уже сохранённое.
+MODELS = {
+    'ingredients': (
+        Ingredient, ('name', 'measurement_unit'), NUTRITION_FIELDS
+    ),
+    'tags': (Tag, ('slug',), ('name', 'color')),
+}
+
+
+def read_csv(path, fields):
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if row:
+                yield dict(zip(fields, (value.strip() for value in row)))
+
+
+def read_json(path, fields, buffer_size=64 * 1024):
+    """Читает JSON-массив объектов по одному, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = f.read(buffer_size).lstrip()
+        if not buffer.startswith('['):
+            raise CommandError('JSON file must contain an array')
+        buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except ValueError:
+                chunk = f.read(buffer_size)
+                if not chunk:
+                    raise CommandError('Unexpected end of JSON file')
+                buffer += chunk
+                continue
+            buffer = buffer[end:]
+            yield {
+                field: str(
+                    '' if item.get(field) is None else item[field]
+                ).strip()
+                for field in fields
+            }
+
+
+def convert(model, data_fields, rows):
+    """Приводит поля с данными к типам модели, пустые - к None."""
+    converters = {
+        field: model._meta.get_field(field).to_python
+        for field in data_fields
+    }
+    for number, row in enumerate(rows, 1):
+        for field, to_python in converters.items():
+            value = row.get(field) or None
+            try:
+                row[field] = None if value is None else to_python(value)
+            except ValidationError:
+                raise CommandError(
+                    f'Row {number}: invalid {field} value {value!r}'
+                )
+        yield row
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
 
 class Command(BaseCommand):
-    help = 'Displays current time'
-
-    def handle(self, *args, **kwargs):
-        with open(data_path, encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                _, created = Ingredient.objects.get_or_create(
-                                                    name=row[0],
-                                                    measurement_unit=row[1])
+    help = 'Loads ingredients or tags from a CSV or JSON file in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=data_path)
+        parser.add_argument(
+            '--model', choices=sorted(MODELS), default='ingredients'
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count changes without writing them'
+        )
+
+    def handle(self, *args, **options):
+        model, key_fields, data_fields = MODELS[options['model']]
+        fields = key_fields + data_fields
+        path = options['path']
+        if path.endswith('.json'):
+            rows = read_json(path, fields)
+        else:
+            rows = read_csv(path, fields)
+        rows = convert(model, data_fields, rows)
+        if connection.vendor == 'postgresql' and not options['dry_run']:
+            totals, updated_ids = self._copy_postgresql(
+                model, key_fields, data_fields, rows, options['chunk_size']
+            )
+        else:
+            totals, updated_ids = self._load_chunks(
+                model, key_fields, data_fields, rows, options
+            )
+        if not options['dry_run']:
+            if model is Ingredient:
+                # Как сигнал Ingredient: только рецепты с изменёнными
+                # ингредиентами, новые ни в одном рецепте не участвуют.
+                for ids in chunked(sorted(updated_ids), RECIPE_UPDATE_BATCH):
+                    Recipe.objects.filter(
+                        recipe_ing__ingredient__in=ids
+                    ).distinct().update_nutrition()
+            bump_version(options['model'])
+            bump_version('recipes')
+        prefix = 'Dry run: ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}inserted {totals['inserted']}, "
+            f"updated {totals['updated']}, skipped {totals['skipped']}"
+        ))
+
+    def _load_chunks(self, model, key_fields, data_fields, rows, options):
+        totals = {'inserted': 0, 'updated': 0, 'skipped': 0}
+        updated_ids = set()
+        for chunk in chunked(rows, options['chunk_size']):
+            with transaction.atomic():
+                result, ids = self._load_chunk(
+                    model, key_fields, data_fields, chunk,
+                    options['dry_run']
+                )
+            for name, value in result.items():
+                totals[name] += value
+            updated_ids.update(ids)
+        return totals, updated_ids
+
+    @staticmethod
+    def _load_chunk(model, key_fields, data_fields, chunk, dry_run):
+        rows = {}
+        for row in chunk:
+            if all(row.get(field) for field in key_fields):
+                rows[tuple(row[field] for field in key_fields)] = row
+        skipped = len(chunk) - len(rows)
+        first_key = key_fields[0]
+        existing = {
+            tuple(getattr(obj, field) for field in key_fields): obj
+            for obj in model.objects.filter(**{
+                f'{first_key}__in': {row[first_key] for row in rows.values()}
+            })
+        }
+        to_create, to_update = [], []
+        for key, row in rows.items():
+            obj = existing.get(key)
+            if obj is None:
+                to_create.append(model(**{
+                    field: value for field, value in row.items()
+                    if value is not None
+                }))
+                continue
+            changed = [
+                field for field in data_fields
+                if row.get(field) is not None
+                and getattr(obj, field) != row[field]
+            ]
+            if not changed:
+                skipped += 1
+                continue
+            for field in changed:
+                setattr(obj, field, row[field])
+            to_update.append(obj)
+        if not dry_run:
+            model.objects.bulk_create(to_create, ignore_conflicts=True)
+            if data_fields:
+                model.objects.bulk_update(to_update, data_fields)
+        return {
+            'inserted': len(to_create),
+            'updated': len(to_update),
+            'skipped': skipped,
+        }, [obj.pk for obj in to_update]
+
+    @staticmethod
+    def _copy_postgresql(model, key_fields, data_fields, rows, chunk_size):
+        """COPY во временную таблицу и вставка/обновление одним запросом."""
+        table = model._meta.db_table
+        columns = ', '.join(key_fields + data_fields)
+        keys = ', '.join(key_fields)
+        key_match = ' AND '.join(f't.{key} = s.{key}' for key in key_fields)
+        not_empty = ' AND '.join(f"s.{key} <> ''" for key in key_fields)
+        staging = (
+            f'(SELECT DISTINCT ON ({keys}) * FROM import_staging s '
+            f'WHERE {not_empty} ORDER BY {keys}) s'
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE import_staging ON COMMIT DROP AS '
+                f'SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            total = 0
+            for chunk in chunked(rows, chunk_size):
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in chunk:
+                    writer.writerow(
+                        None if row.get(field) in (None, '') else row[field]
+                        for field in key_fields + data_fields
+                    )
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY import_staging ({columns}) '
+                    f'FROM STDIN WITH (FORMAT csv)',
+                    buffer
+                )
+                total += len(chunk)
+            updated_ids = set()
+            if data_fields:
+                assignments = ', '.join(
+                    f'{field} = COALESCE(s.{field}, t.{field})'
+                    for field in data_fields
+                )
+                changed = ' OR '.join(
+                    f'(s.{field} IS NOT NULL '
+                    f'AND t.{field} IS DISTINCT FROM s.{field})'
+                    for field in data_fields
+                )
+                cursor.execute(
+                    f'UPDATE {table} t SET {assignments} FROM {staging} '
+                    f'WHERE {key_match} AND ({changed}) RETURNING t.id'
+                )
+                updated_ids = {pk for pk, in cursor.fetchall()}
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT {columns} FROM {staging} WHERE NOT EXISTS '
+                f'(SELECT 1 FROM {table} t WHERE {key_match}) '
+                f'ON CONFLICT DO NOTHING'
+            )
+            inserted = cursor.rowcount
+        return {
+            'inserted': inserted,
+            'updated': len(updated_ids),
+            'skipped': total - inserted - len(updated_ids),
+        }, updated_ids
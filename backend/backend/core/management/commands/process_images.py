@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Builds WebP variants for recipe images that have none yet'
+
+    def handle(self, *args, **kwargs):
+        recipes = Recipe.objects.filter(image_hash='').exclude(
+            image=''
+        ).exclude(image__isnull=True).values_list('pk', flat=True)
+        processed = 0
+        for recipe_id in recipes.iterator():
+            process_recipe_image(recipe_id)
+            processed += 1
+        self.stdout.write(f'Recipes processed: {processed}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.utils import recount_recipe_counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds favorite and shopping cart counters of recipes'
+
+    def handle(self, *args, **kwargs):
+        updated = recount_recipe_counters()
+        self.stdout.write(f'Recipes updated: {updated}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.cache import bump_version
+from core.ranking import update_scores
+
+
+class Command(BaseCommand):
+    help = 'Recomputes popular and trending scores of all recipes'
+
+    def handle(self, *args, **kwargs):
+        updated = update_scores()
+        bump_version('recipes')
+        self.stdout.write(f'Recipes updated: {updated}')
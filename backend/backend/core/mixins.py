@@ -1,15 +1,65 @@
-from rest_framework import viewsets
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
 
+from .cache import get_cached_json
 from .permissions import IsAdminOrReadOnly
-from recipes.serializers import LightRecipeSerializer
+from .utils import add_recipes, remove_recipes
+from recipes.serializers import LightRecipeSerializer, RecipeIdsSerializer
+
+
+def cached_json_response(request, payload, etag):
+    """Ответ из кэша; 304, если у клиента та же версия."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and etag in parse_etags(if_none_match):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(payload, content_type='application/json')
+    response['ETag'] = etag
+    return response
 
 
 class IngredientsTagsMixin(viewsets.ModelViewSet):
     permission_classes = (IsAdminOrReadOnly, )
     pagination_class = None
+    cache_name = None
+
+    def _render_list(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer(queryset, many=True)
+        return JSONRenderer().render(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        payload, etag = get_cached_json(self.cache_name, self._render_list)
+        return cached_json_response(request, payload, etag)
 
 
 class ListCartFavoriteMixin(viewsets.ModelViewSet):
     serializer_class = LightRecipeSerializer
     permission_classes = (IsAuthenticated | IsAdminUser, )
+    model = None
+
+    @action(detail=False, methods=['POST', 'DELETE'], url_path='bulk')
+    def bulk(self, request):
+        """Добавляет или убирает рецепты списком {"recipes": [id, ...]}."""
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(
+            recipe.pk for recipe in serializer.validated_data['recipes']
+        ))
+        if request.method == 'POST':
+            added = add_recipes(self.model, request.user, recipe_ids)
+            skipped = set(recipe_ids) - set(added)
+            return Response({
+                'added': added,
+                'skipped': [pk for pk in recipe_ids if pk in skipped]
+            }, status=status.HTTP_201_CREATED)
+        return Response({
+            'removed': remove_recipes(self.model, request.user, recipe_ids)
+        })
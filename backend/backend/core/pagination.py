@@ -0,0 +1,125 @@
+import base64
+import binascii
+import math
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .ranking import RANKINGS
+
+
+class LimitPageNumberPagination(PageNumberPagination):
+    """Постраничная выдача по page/limit."""
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class RecipePagination(LimitPageNumberPagination):
+    """
+    Постраничная выдача рецептов по page/limit.
+
+    С параметром cursor (для первой страницы - пустым) выдача идёт по
+    ключу (pub_date, id), а с ?ordering=popular|trending - по ключу
+    (рейтинг, id), без OFFSET и COUNT(*).
+    """
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def get_cursor_field(self, request):
+        return RANKINGS.get(
+            request.query_params.get(self.ordering_query_param), 'pub_date'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params[self.cursor_query_param]
+        field = self.get_cursor_field(request)
+        queryset = queryset.order_by(f'-{field}', '-id')
+        if cursor:
+            value, pk = self.decode_cursor(cursor, field)
+            queryset = queryset.filter(
+                Q(**{f'{field}__lt': value})
+                | Q(**{field: value, 'id__lt': pk})
+            )
+        results = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            last = results[-1]
+            self.next_cursor = self.encode_cursor(
+                getattr(last, field), last.pk
+            )
+        return results
+
+    def encode_cursor(self, value, pk):
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        else:
+            # repr() у float обратим, курсор совпадает со значением в базе.
+            value = repr(value)
+        position = f'{value}|{pk}'.encode()
+        return base64.urlsafe_b64encode(position).decode()
+
+    def decode_cursor(self, cursor, field='pub_date'):
+        try:
+            position = base64.urlsafe_b64decode(cursor.encode()).decode()
+            value, pk = position.rsplit('|', 1)
+            pk = int(pk)
+            if field == 'pub_date':
+                value = parse_datetime(value)
+            else:
+                value = float(value)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None or (
+            isinstance(value, float) and not math.isfinite(value)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+
+class FeedPagination(RecipePagination):
+    """Лента подписок: всегда по курсору."""
+
+    def paginate_feed(self, fetch, request):
+        """fetch(after, limit) возвращает позиции (pub_date, id) ленты."""
+        self.cursor_mode = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        after = self.decode_cursor(cursor) if cursor else None
+        positions = fetch(after, page_size + 1)
+        self.next_cursor = None
+        if len(positions) > page_size:
+            positions = positions[:page_size]
+            self.next_cursor = self.encode_cursor(*positions[-1])
+        return positions
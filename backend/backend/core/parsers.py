@@ -0,0 +1,48 @@
+import json
+
+from django.conf import settings
+from django.utils.datastructures import MultiValueDict
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, JSONParser, MultiPartParser
+
+from .exceptions import PayloadTooLarge
+
+
+def check_content_length(request):
+    """Отклоняет запрос по Content-Length, не читая тело."""
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > settings.RECIPE_REQUEST_MAX_BYTES:
+        raise PayloadTooLarge()
+
+
+class LimitedJSONParser(JSONParser):
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        check_content_length(parser_context['request'])
+        return super().parse(stream, media_type, parser_context)
+
+
+class RecipeMultiPartParser(MultiPartParser):
+    """
+    multipart/form-data: рецепт в поле data в виде JSON, изображение -
+    файлом в поле image. Файл пишется на диск по частям.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        check_content_length(parser_context['request'])
+        result = super().parse(stream, media_type, parser_context)
+        if 'data' not in result.data:
+            return result
+        try:
+            data = json.loads(result.data['data'])
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+        if not isinstance(data, dict):
+            raise ParseError('JSON parse error - data must be an object')
+        # Файлы кладём в data сами: DRF объединяет их через dict.update,
+        # и у обычного словаря значения стали бы списками.
+        data.update(result.files.dict())
+        return DataAndFiles(data, MultiValueDict())
@@ -0,0 +1,135 @@
+"""
+Рейтинги рецептов popular и trending по добавлениям в избранное и
+корзину с экспоненциальным затуханием.
+
+В колонке рейтинга хранится ln(sum(exp(k * (t - EPOCH)))) по событиям
+рецепта, k = ln 2 / период полураспада. Порядок по такому значению
+совпадает с порядком по затухшей к текущему моменту сумме, поэтому
+сортировка идёт по индексу, а новое событие - это один UPDATE без
+пересчёта остальных рецептов. Накопленную погрешность убирает команда
+update_recipe_scores.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Abs, Exp, Greatest, Least, Ln
+
+from recipes.models import Cart, Favorite, Recipe
+
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+# Значение рецепта без событий; события после EPOCH дают больше нуля.
+EMPTY_SCORE = 0.0
+# exp() в PostgreSQL падает на исчезающе малых значениях.
+MIN_EXPONENT = -50
+MIN_REMAINDER = 1e-12
+
+RANKINGS = {
+    'popular': 'popular_score',
+    'trending': 'trending_score',
+}
+
+
+def _half_lives():
+    return {
+        'popular_score': settings.POPULAR_HALF_LIFE,
+        'trending_score': settings.TRENDING_HALF_LIFE,
+    }
+
+
+def _position(moment, half_life):
+    return (
+        math.log(2) * (moment - EPOCH).total_seconds()
+        / half_life.total_seconds()
+    )
+
+
+def _added(field, position):
+    """ln(exp(score) + exp(position)) без переполнения."""
+    score, position = F(field), Value(position)
+    return Greatest(score, position) + Ln(1 + Exp(Greatest(
+        -Abs(score - position), Value(MIN_EXPONENT)
+    )))
+
+
+def _removed(field, position):
+    """ln(exp(score) - exp(position)), не меньше score + ln(1e-12)."""
+    score, position = F(field), Value(position)
+    return score + Ln(Greatest(
+        1 - Exp(Least(
+            Greatest(position - score, Value(MIN_EXPONENT)), Value(0.0)
+        )),
+        Value(MIN_REMAINDER)
+    ))
+
+
+def record_added(recipe_ids, moment):
+    """Учитывает добавление рецептов в избранное или корзину."""
+    if not recipe_ids:
+        return
+    Recipe.objects.filter(pk__in=recipe_ids).update(**{
+        field: _added(field, _position(moment, half_life))
+        for field, half_life in _half_lives().items()
+    })
+
+
+def record_removed(entries):
+    """
+    Убирает вклад удалённых записей [(recipe_id, created)]. Вызывать
+    после изменения счётчиков: рецепт без событий получает EMPTY_SCORE.
+    """
+    groups = defaultdict(list)
+    for recipe_id, created in entries:
+        groups[created].append(recipe_id)
+    for created, recipe_ids in groups.items():
+        Recipe.objects.filter(pk__in=recipe_ids).update(**{
+            field: Case(
+                When(
+                    favorites_count=0, carts_count=0,
+                    then=Value(EMPTY_SCORE)
+                ),
+                default=_removed(field, _position(created, half_life)),
+                output_field=FloatField()
+            )
+            for field, half_life in _half_lives().items()
+        })
+
+
+def _log_add_exp(score, position):
+    if score is None:
+        return position
+    top = max(score, position)
+    return top + math.log1p(math.exp(-abs(score - position)))
+
+
+def update_scores(batch_size=1000, recipe_model=Recipe,
+                  event_models=(Favorite, Cart)):
+    """
+    Точно пересчитывает рейтинги всех рецептов по событиям. Модели
+    передаются из миграций, где нужны исторические версии.
+    """
+    half_lives = _half_lives()
+    scores = defaultdict(dict)
+    for model in event_models:
+        events = model.objects.values_list('recipe_id', 'created')
+        for recipe_id, created in events.iterator():
+            recipe_scores = scores[recipe_id]
+            for field, half_life in half_lives.items():
+                recipe_scores[field] = _log_add_exp(
+                    recipe_scores.get(field), _position(created, half_life)
+                )
+    recipes = []
+    for recipe in recipe_model.objects.only('pk').iterator():
+        for field in half_lives:
+            setattr(recipe, field, scores.get(recipe.pk, {}).get(
+                field, EMPTY_SCORE
+            ))
+        recipes.append(recipe)
+    with transaction.atomic():
+        recipe_model.objects.bulk_update(
+            recipes, list(half_lives), batch_size=batch_size
+        )
+    return len(recipes)
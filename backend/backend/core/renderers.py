@@ -0,0 +1,160 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer
+
+from recipes.models import Recipe
+
+
+def format_amount(amount):
+    if float(amount).is_integer():
+        return int(amount)
+    return amount
+
+
+def format_totals(totals):
+    """Итоги корзины с округлением; неизвестные остаются None."""
+    return {
+        field: None if value is None else format_amount(round(value, 2))
+        for field, value in (totals or {}).items()
+    }
+
+
+def total_lines(totals):
+    """Пары (название, значение) итогов корзины, известные из рецептов."""
+    for field, value in format_totals(totals).items():
+        if value is not None:
+            yield Recipe._meta.get_field(field).verbose_name, value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер списка покупок.
+
+    Сам список отдаётся потоком через stream(), а render() нужен DRF
+    только для ответов с ошибками.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and 'detail' in data:
+            data = data['detail']
+        return str(data).encode(self.charset or 'utf-8')
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    def stream(self, items, totals=None):
+        raise NotImplementedError
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, items, totals=None):
+        for item in items:
+            yield (
+                f"{item['name']}: {format_amount(item['amount'])} "
+                f"{item['measurement_unit']}\n"
+            )
+        lines = list(total_lines(totals))
+        if lines:
+            yield '\nИтого по корзине:\n'
+        for name, value in lines:
+            yield f'{name}: {value}\n'
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, items, totals=None):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(('name', 'amount', 'measurement_unit'))
+        for item in items:
+            writer.writerow((
+                item['name'],
+                format_amount(item['amount']),
+                item['measurement_unit']
+            ))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        lines = list(total_lines(totals))
+        if lines:
+            writer.writerow(())
+        for name, value in lines:
+            writer.writerow((f'Итого: {name}', value, ''))
+        yield buffer.getvalue()
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, items, totals=None):
+        separator = '{"items": ['
+        for item in items:
+            item['amount'] = format_amount(item['amount'])
+            yield separator + json.dumps(item, ensure_ascii=False)
+            separator = ','
+        yield '{"items": []' if separator != ',' else ']'
+        yield ', "totals": ' + json.dumps(format_totals(totals)) + '}'
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    """
+    PDF собирается reportlab целиком, поэтому отдаётся одним куском.
+
+    Для кириллицы нужен TTF-шрифт из SHOPPING_LIST_PDF_FONT.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+
+    def _register_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_LIST_PDF_FONT)
+            )
+
+    def stream(self, items, totals=None):
+        self._register_font()
+        buffer = io.BytesIO()
+        page = canvas.Canvas(buffer, pagesize=A4)
+        width, height = A4
+        margin = 50
+        line_height = self.font_size * 1.5
+        top = height - margin
+        y = top
+        page.setFont(self.font_name, self.font_size)
+        for line in TextShoppingListRenderer().stream(items, totals):
+            if y < margin:
+                page.showPage()
+                page.setFont(self.font_name, self.font_size)
+                y = top
+            page.drawString(margin, y, line.rstrip('\n'))
+            y -= line_height
+        page.save()
+        yield buffer.getvalue()
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONShoppingListRenderer,
+    PDFShoppingListRenderer,
+)
@@ -0,0 +1,189 @@
+"""
+Похожие рецепты по ингредиентам и тегам.
+
+Рецепт - TF-IDF вектор из ингредиентов и тегов (вес тега меньше),
+сходство - косинус. Для каждого рецепта в SimilarRecipe хранится
+SIMILAR_RECIPES_COUNT ближайших соседей.
+
+Полный пересчёт перемножает разреженные матрицы кусками строк, так что
+память ограничена CHUNK_CELLS. После изменения состава рецепта
+пересчитываются его соседи и его место в списках остальных рецептов,
+прочие сходства со сдвинувшимися весами признаков остаются прежними.
+Если рецепт выпал из чужого списка, список до следующего полного
+пересчёта остаётся короче.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from scipy import sparse
+
+from recipes.models import Recipe, RecipeIngredient, RecipeTag, SimilarRecipe
+from .utils import keep_first
+
+# Вес тега относительно ингредиента той же редкости.
+TAG_WEIGHT = 0.5
+# Размер плотного куска матрицы сходства: 2 ** 24 float64 - 128 МБ.
+CHUNK_CELLS = 2 ** 24
+BATCH_SIZE = 5000
+
+# Признаки кодируются числами: ингредиент 2 * id, тег 2 * id + 1.
+FEATURES = (
+    (RecipeIngredient, 'ingredient_id', 0, 1.0),
+    (RecipeTag, 'tag_id', 1, TAG_WEIGHT),
+)
+
+
+def _feature_weights():
+    """Вес {код признака: idf} по всем рецептам."""
+    total = Recipe.objects.count()
+    weights = {}
+    for model, field, shift, scale in FEATURES:
+        counts = model.objects.order_by().values(field).annotate(
+            recipes=Count('recipe')
+        ).values_list(field, 'recipes')
+        for feature, count in counts:
+            weights[feature * 2 + shift] = scale * (
+                math.log((1 + total) / (1 + count)) + 1
+            )
+    return weights
+
+
+def _pairs(recipes=None):
+    """Массив строк (рецепт, код признака)."""
+    parts = []
+    for model, field, shift, _ in FEATURES:
+        rows = model.objects.order_by()
+        if recipes is not None:
+            rows = rows.filter(recipe__in=recipes)
+        pairs = np.array(
+            list(rows.values_list('recipe_id', field)), dtype=np.int64
+        ).reshape(-1, 2)
+        pairs[:, 1] = pairs[:, 1] * 2 + shift
+        parts.append(pairs)
+    return np.concatenate(parts)
+
+
+def _matrix(recipes=None):
+    """Нормированная матрица рецепты x признаки и id рецептов по строкам."""
+    pairs = _pairs(recipes)
+    recipe_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    codes, columns = np.unique(pairs[:, 1], return_inverse=True)
+    weights = _feature_weights()
+    values = np.array([weights.get(code, 0.0) for code in codes.tolist()])
+    matrix = sparse.csr_matrix(
+        (values[columns], (rows, columns)),
+        shape=(len(recipe_ids), len(codes))
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix, recipe_ids
+
+
+def _top_neighbours(matrix, rows, count):
+    """Для строк rows - (строка, строки соседей, сходства), ближние первыми."""
+    count = min(count, matrix.shape[0] - 1)
+    if count < 1:
+        return
+    transposed = matrix.T.tocsr()
+    step = max(1, CHUNK_CELLS // matrix.shape[0])
+    for start in range(0, len(rows), step):
+        part = rows[start:start + step]
+        scores = (matrix[part] @ transposed).toarray()
+        scores[np.arange(len(part)), part] = 0
+        top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        for row, neighbours, values in zip(part, top, top_scores):
+            found = values > 0
+            yield row, neighbours[found], values[found]
+
+
+def _entries(recipe_ids, row, neighbours, scores):
+    return [
+        SimilarRecipe(
+            recipe_id=int(recipe_ids[row]),
+            similar_id=int(recipe_ids[neighbour]),
+            score=float(score)
+        )
+        for neighbour, score in zip(neighbours, scores)
+    ]
+
+
+def build_similar_recipes():
+    """Пересчитывает соседей всех рецептов; возвращает число записей."""
+    matrix, recipe_ids = _matrix()
+    created, batch = 0, []
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        for row, neighbours, scores in _top_neighbours(
+            matrix, np.arange(len(recipe_ids)),
+            settings.SIMILAR_RECIPES_COUNT
+        ):
+            batch.extend(_entries(recipe_ids, row, neighbours, scores))
+            if len(batch) >= BATCH_SIZE:
+                SimilarRecipe.objects.bulk_create(batch)
+                created, batch = created + len(batch), []
+        SimilarRecipe.objects.bulk_create(batch)
+    return created + len(batch)
+
+
+def refresh_similar_recipes(recipe_id):
+    """Пересчитывает соседей рецепта после изменения его состава."""
+    count = settings.SIMILAR_RECIPES_COUNT
+    candidates = Recipe.objects.filter(
+        Q(pk__in=RecipeIngredient.objects.filter(
+            ingredient__in=RecipeIngredient.objects.filter(
+                recipe=recipe_id
+            ).values('ingredient')
+        ).values('recipe'))
+        | Q(pk__in=RecipeTag.objects.filter(
+            tag__in=RecipeTag.objects.filter(recipe=recipe_id).values('tag')
+        ).values('recipe'))
+    ).values('pk')
+    matrix, recipe_ids = _matrix(candidates)
+    row = int(np.searchsorted(recipe_ids, recipe_id))
+    with transaction.atomic():
+        # Списки, где был рецепт, считаются без него: если он стал
+        # дальше всех остальных соседей, он из списка выпадает.
+        lists = {
+            item['recipe']: item
+            for item in SimilarRecipe.objects.filter(
+                recipe__in=candidates
+            ).exclude(similar=recipe_id).values('recipe').annotate(
+                lowest=Min('score'), total=Count('pk')
+            ).order_by()
+        }
+        listed_in = set(SimilarRecipe.objects.filter(
+            similar=recipe_id
+        ).values_list('recipe', flat=True))
+        SimilarRecipe.objects.filter(
+            Q(recipe=recipe_id) | Q(similar=recipe_id)
+        ).delete()
+        if row == len(recipe_ids) or recipe_ids[row] != recipe_id:
+            return
+        for _, neighbours, scores in _top_neighbours(matrix, [row], count):
+            SimilarRecipe.objects.bulk_create(
+                _entries(recipe_ids, row, neighbours, scores)
+            )
+        scores = (matrix @ matrix[row].T).toarray().ravel()
+        scores[row] = 0
+        entries = []
+        for other in np.flatnonzero(scores > 0).tolist():
+            other_id = int(recipe_ids[other])
+            current = lists.get(other_id, {'lowest': 0, 'total': 0})
+            total = current['total'] + (other_id in listed_in)
+            if total < count or scores[other] > current['lowest']:
+                entries.extend(_entries(
+                    recipe_ids, other, [row], [scores[other]]
+                ))
+        SimilarRecipe.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+        keep_first(
+            SimilarRecipe, 'recipe_id', 'score DESC, similar_id DESC',
+            SimilarRecipe.objects.filter(similar=recipe_id).values('recipe'),
+            count
+        )
@@ -0,0 +1,101 @@
+"""
+Лента рецептов из подписок.
+
+Новый рецепт после коммита раскладывается в фоне в TimelineEntry
+подписчиков автора (fan-out on write), лента каждого ограничена
+FEED_TIMELINE_SIZE записями; пока рецепт не разложен, он подмешивается
+при чтении. Рецепты авторов, у которых подписчиков больше
+FEED_FANOUT_MAX_FOLLOWERS, не раскладываются (fanned_out=False) и
+подмешиваются при чтении ленты (fan-out on read).
+"""
+from django.conf import settings
+from django.db.models import Count, Q
+
+from recipes.models import Recipe, TimelineEntry
+from users.models import Follow, User
+from .utils import keep_first
+
+
+def trim_timelines(users):
+    """Обрезает ленты пользователей из values-queryset users до размера."""
+    keep_first(
+        TimelineEntry, 'user_id', 'pub_date DESC, recipe_id DESC', users,
+        settings.FEED_TIMELINE_SIZE
+    )
+
+
+def fan_out_recipe(recipe_id):
+    """Раскладывает новый рецепт по лентам подписчиков автора."""
+    recipe = Recipe.objects.filter(pk=recipe_id).values(
+        'author_id', 'pub_date'
+    ).first()
+    if recipe is None:
+        return
+    follower_ids = list(
+        Follow.objects.filter(author_id=recipe['author_id']).values_list(
+            'user_id', flat=True
+        )[:settings.FEED_FANOUT_MAX_FOLLOWERS + 1]
+    )
+    if len(follower_ids) > settings.FEED_FANOUT_MAX_FOLLOWERS:
+        return
+    TimelineEntry.objects.bulk_create((
+        TimelineEntry(
+            user_id=user, recipe_id=recipe_id, pub_date=recipe['pub_date']
+        )
+        for user in follower_ids
+    ), ignore_conflicts=True)
+    # Обрезаются только ленты, которые переполнил новый рецепт.
+    overflowed = list(
+        TimelineEntry.objects.filter(
+            user__in=follower_ids
+        ).order_by().values('user_id').annotate(total=Count('id')).filter(
+            total__gt=settings.FEED_TIMELINE_SIZE
+        ).values_list('user_id', flat=True)
+    )
+    if overflowed:
+        trim_timelines(User.objects.filter(pk__in=overflowed).values('pk'))
+    Recipe.objects.filter(pk=recipe_id).update(fanned_out=True)
+
+
+def backfill_timeline(user, author):
+    """Добавляет в ленту нового подписчика последние рецепты автора."""
+    recipes = Recipe.objects.filter(
+        author=author, fanned_out=True
+    ).order_by('-pub_date', '-id').values_list('id', 'pub_date')
+    TimelineEntry.objects.bulk_create((
+        TimelineEntry(user=user, recipe_id=pk, pub_date=pub_date)
+        for pk, pub_date in recipes[:settings.FEED_TIMELINE_SIZE]
+    ), ignore_conflicts=True)
+    trim_timelines(User.objects.filter(pk=user.pk).values('pk'))
+
+
+def remove_from_timeline(user, author):
+    TimelineEntry.objects.filter(user=user, recipe__author=author).delete()
+
+
+def _after(field, position):
+    pub_date, pk = position
+    return Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, **{
+        f'{field}__lt': pk
+    })
+
+
+def feed_positions(user, after=None, limit=None):
+    """
+    Позиции (pub_date, id) рецептов ленты после after, не больше limit.
+
+    Лента и рецепты тяжёлых авторов читаются двумя запросами по
+    индексам и сливаются.
+    """
+    timeline = TimelineEntry.objects.filter(user=user).order_by(
+        '-pub_date', '-recipe_id'
+    ).values_list('pub_date', 'recipe_id')
+    direct = Recipe.objects.filter(
+        fanned_out=False,
+        author__in=Follow.objects.filter(user=user).values('author_id')
+    ).order_by('-pub_date', '-id').values_list('pub_date', 'id')
+    if after is not None:
+        timeline = timeline.filter(_after('recipe_id', after))
+        direct = direct.filter(_after('id', after))
+    positions = set(timeline[:limit]) | set(direct[:limit])
+    return sorted(positions, reverse=True)[:limit]
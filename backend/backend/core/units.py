@@ -0,0 +1,39 @@
+"""
+Единицы измерения ингредиентов из data/ingredients.csv.
+
+Массы и объёмы приводятся к граммам и миллилитрам. Пищевая ценность и
+цена ингредиента задаются на 100 г или 100 мл, а для остальных единиц
+(шт., ст. л., по вкусу) - на одну единицу.
+"""
+UNIT_CONVERSIONS = {
+    'г': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+}
+NUTRITION_BASE = 100
+NUTRITION_FIELDS = ('kcal', 'protein', 'fat', 'carbs', 'price')
+
+
+def normalize_amount(amount, measurement_unit):
+    """Приводит количество к базовой единице: кг -> г, л -> мл."""
+    unit, ratio = UNIT_CONVERSIONS.get(
+        measurement_unit.strip(), (measurement_unit, 1)
+    )
+    return amount * ratio, unit
+
+
+def nutrition_portions(amount, measurement_unit):
+    """
+    SQL и параметры: во сколько раз количество amount в единицах
+    measurement_unit больше того, на которое задана пищевая ценность.
+    """
+    whens = ' '.join(
+        f'WHEN %s THEN {amount} * %s' for _ in UNIT_CONVERSIONS
+    )
+    params = [
+        value
+        for unit, (_, ratio) in UNIT_CONVERSIONS.items()
+        for value in (unit, ratio / NUTRITION_BASE)
+    ]
+    return f'CASE {measurement_unit} {whens} ELSE {amount} END', params
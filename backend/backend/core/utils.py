@@ -1,25 +1,299 @@
-from django.db.models import Sum
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from recipes.models import RecipeIngredient
+from recipes.models import Cart, Favorite, Recipe, ShoppingListItem
+from users.models import User
+from .ranking import record_added, record_removed
+from .units import NUTRITION_FIELDS, normalize_amount
+
+AMOUNT_EPSILON = 1e-9
+
+KEEP_FIRST = """
+DELETE FROM {table} WHERE id IN (
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY {group} ORDER BY {ordering}
+        ) AS position
+        FROM {table} WHERE {group} IN ({groups})
+    ) ranked WHERE position > %s
+)
+"""
+
+
+def keep_first(model, group, ordering, groups, size):
+    """
+    Оставляет в каждой группе строк model первые size по SQL-сортировке
+    ordering. groups - values-queryset с номерами групп.
+    """
+    groups_sql, params = groups.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            KEEP_FIRST.format(
+                table=model._meta.db_table, group=group,
+                ordering=ordering, groups=groups_sql
+            ),
+            (*params, size)
+        )
+
+
+def _count_for_recipe(model):
+    counts = model.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def recount_recipe_counters():
+    """Пересчитывает счётчики избранного и корзин одним UPDATE."""
+    return Recipe.objects.update(
+        favorites_count=_count_for_recipe(Favorite),
+        carts_count=_count_for_recipe(Cart)
+    )
+
+
+def _merge_units(name, rows):
+    totals = {}
+    for amount, measurement_unit in rows:
+        amount, unit = normalize_amount(amount, measurement_unit)
+        totals[unit] = totals.get(unit, 0) + amount
+    for unit in sorted(totals):
+        yield {
+            'name': name,
+            'amount': round(totals[unit], 3),
+            'measurement_unit': unit
+        }
+
+
+def get_cart_totals(carts):
+    """Живой SUM ингредиентов по записям корзины."""
+    totals = carts.values(
+        'user', 'recipe__recipe_ing__ingredient'
+    ).annotate(total=Sum('recipe__recipe_ing__amount')).order_by()
+    return {
+        (row['user'], row['recipe__recipe_ing__ingredient']): row['total']
+        for row in totals
+        if row['recipe__recipe_ing__ingredient'] is not None
+    }
+
+
+def _apply_shopping_list_deltas(deltas):
+    if not deltas:
+        return
+    users = {user for user, _ in deltas}
+    ingredients = {ingredient for _, ingredient in deltas}
+    existing = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingListItem.objects.select_for_update().filter(
+            user__in=users, ingredient__in=ingredients
+        )
+    }
+    to_create, to_update, to_delete = [], [], []
+    for (user, ingredient), delta in deltas.items():
+        item = existing.get((user, ingredient))
+        if item is None:
+            if delta > AMOUNT_EPSILON:
+                to_create.append(ShoppingListItem(
+                    user_id=user, ingredient_id=ingredient, amount=delta
+                ))
+            continue
+        item.amount += delta
+        if item.amount > AMOUNT_EPSILON:
+            to_update.append(item)
+        else:
+            to_delete.append(item.pk)
+    ShoppingListItem.objects.bulk_create(to_create)
+    ShoppingListItem.objects.bulk_update(to_update, ['amount'])
+    if to_delete:
+        ShoppingListItem.objects.filter(pk__in=to_delete).delete()
+
+
+def add_to_shopping_lists(carts):
+    """Добавляет рецепты из записей корзины в списки покупок."""
+    with transaction.atomic():
+        _apply_shopping_list_deltas(get_cart_totals(carts))
+
+
+def remove_from_shopping_lists(carts):
+    """Вычитает рецепты; вызывать до удаления записей корзины."""
+    with transaction.atomic():
+        _apply_shopping_list_deltas({
+            key: -total for key, total in get_cart_totals(carts).items()
+        })
+
+
+def change_in_shopping_lists(recipe, deltas):
+    """
+    Переносит изменение состава рецепта ({ингредиент: разница})
+    в списки покупок всех, у кого рецепт в корзине. Рецепт должен быть
+    заблокирован lock_recipes до изменения ингредиентов.
+    """
+    if not deltas:
+        return
+    with transaction.atomic():
+        # Корзины читаются под блокировкой рецепта, как в add_recipes:
+        # иначе новая запись корзины получит старый состав без разницы.
+        # Повторная блокировка своей строки ничего не ждёт.
+        lock_recipes([recipe.pk])
+        _apply_shopping_list_deltas({
+            (user, ingredient): delta
+            for user in Cart.objects.filter(recipe=recipe).values_list(
+                'user', flat=True
+            )
+            for ingredient, delta in deltas.items()
+        })
+
+
+def _lock_rows(queryset):
+    """
+    Блокирует строки queryset. В PostgreSQL - FOR NO KEY UPDATE: вставки
+    строк со ссылкой на заблокированную (корзина, список покупок) её
+    не ждут, и взаимоблокировок с ними нет. В Django 2.2 у
+    select_for_update ещё нет no_key.
+    """
+    if connection.vendor != 'postgresql':
+        list(queryset.select_for_update().values('pk'))
+        return
+    sql, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} FOR NO KEY UPDATE', params)
+
+
+def _lock_user(user):
+    """
+    Запросы одного пользователя к корзине и избранному идут по очереди,
+    иначе параллельное добавление рецепта учлось бы дважды.
+    """
+    _lock_rows(User.objects.filter(pk=user.pk))
+
+
+def lock_recipes(recipe_ids):
+    """
+    Изменения корзин и состава одних рецептов идут по очереди. Рецепты
+    блокируются по возрастанию id, после пользователя и до изменения
+    их ингредиентов: вставка RecipeIngredient уже ссылается на строку
+    рецепта, и блокировка после неё приводит к взаимоблокировке.
+    """
+    _lock_rows(Recipe.objects.filter(pk__in=recipe_ids).order_by('pk'))
+
+
+def _shift_counter(model, recipe_ids, step):
+    if recipe_ids:
+        counter = model.counter_field
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            **{counter: F(counter) + step}
+        )
+
+
+def add_recipes(model, user, recipe_ids):
+    """
+    Добавляет рецепты в корзину или избранное одним INSERT;
+    возвращает id добавленных, уже добавленные пропускаются.
+    """
+    with transaction.atomic():
+        _lock_user(user)
+        if model is Cart:
+            lock_recipes(recipe_ids)
+        existing = set(model.objects.filter(
+            user=user, recipe__in=recipe_ids
+        ).values_list('recipe_id', flat=True))
+        added = [pk for pk in dict.fromkeys(recipe_ids) if pk not in existing]
+        created = timezone.now()
+        model.objects.bulk_create(
+            (model(user=user, recipe_id=pk, created=created) for pk in added),
+            ignore_conflicts=True
+        )
+        _shift_counter(model, added, 1)
+        record_added(added, created)
+        if model is Cart and added:
+            add_to_shopping_lists(
+                Cart.objects.filter(user=user, recipe__in=added)
+            )
+    return added
+
+
+def remove_recipes(model, user, recipe_ids=None):
+    """
+    Убирает рецепты из корзины или избранного, без recipe_ids - все;
+    возвращает id убранных.
+    """
+    with transaction.atomic():
+        _lock_user(user)
+        entries = model.objects.filter(user=user)
+        if recipe_ids is not None:
+            entries = entries.filter(recipe__in=recipe_ids)
+        if model is Cart:
+            lock_recipes(entries.values('recipe_id'))
+        removed = list(entries.values_list('recipe_id', 'created'))
+        if model is Cart:
+            if recipe_ids is None:
+                ShoppingListItem.objects.filter(user=user).delete()
+            else:
+                remove_from_shopping_lists(entries)
+        entries.delete()
+        _shift_counter(model, [pk for pk, _ in removed], -1)
+        record_removed(removed)
+    return [pk for pk, _ in removed]
+
+
+def rebuild_shopping_lists(users):
+    """Пересобирает списки покупок пользователей по живому SUM."""
+    with transaction.atomic():
+        ShoppingListItem.objects.filter(user__in=users).delete()
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(
+                user_id=user, ingredient_id=ingredient, amount=total
+            )
+            for (user, ingredient), total in get_cart_totals(
+                Cart.objects.filter(user__in=users)
+            ).items()
+        )
 
 
 def get_shopping_list(user):
-    shopping_list = {}
-    ingredients = RecipeIngredient.objects.filter(
-        recipe__cart_recipes__user=user
-    ).values(
+    """
+    Сводный список покупок, отсортированный по ингредиентам.
+
+    Читается из поддерживаемой таблицы ShoppingListItem, без агрегации
+    по рецептам корзины.
+    """
+    ingredients = ShoppingListItem.objects.filter(user=user).values(
         'ingredient__name',
-        'ingredient__measurement_unit'
-    ).annotate(total=Sum('amount'))
-    for ingredient in ingredients:
-        amount = ingredient['total']
+        'ingredient__measurement_unit',
+        'amount'
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+    current, rows = None, []
+    for ingredient in ingredients.iterator():
         name = ingredient['ingredient__name']
-        measurement_unit = ingredient['ingredient__measurement_unit']
-        shopping_list[name] = {
-            'measurement_unit': measurement_unit,
-            'amount': amount
+        if name != current and rows:
+            yield from _merge_units(current, rows)
+            rows = []
+        current = name
+        rows.append(
+            (ingredient['amount'], ingredient['ingredient__measurement_unit'])
+        )
+    if rows:
+        yield from _merge_units(current, rows)
+
+
+def get_cart_nutrition(user):
+    """
+    Калорийность, БЖУ и стоимость корзины одним агрегатом по суммам,
+    сохранённым в рецептах. Если у рецепта суммы нет, нет и итога.
+    """
+    totals = Cart.objects.filter(user=user).aggregate(
+        recipes=Count('pk'),
+        **{field: Sum(f'recipe__{field}') for field in NUTRITION_FIELDS},
+        **{
+            f'{field}_known': Count(f'recipe__{field}')
+            for field in NUTRITION_FIELDS
         }
-    return ([f"{item}: {value['amount']}"
-             f" {value['measurement_unit']}\n"
-             for item, value in shopping_list.items()]
-            )
+    )
+    return {
+        field: (
+            totals[field] or 0
+            if totals[f'{field}_known'] == totals['recipes'] else None
+        )
+        for field in NUTRITION_FIELDS
+    }
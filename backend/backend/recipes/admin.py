@@ -1,8 +1,9 @@
 from django.contrib import admin
 
+from core.images import schedule_image_processing
 from .models import (
     Cart, Favorite, Ingredient, Recipe,
-    RecipeIngredient, RecipeTag, Tag
+    RecipeIngredient, RecipeTag, ShoppingListItem, Tag
 )
 
 
@@ -16,15 +17,30 @@ class RecipeTagAdmin(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'in_favorited')
+    list_display = ('name', 'author', 'favorites_count', 'carts_count')
+    list_select_related = ('author',)
+    readonly_fields = ('favorites_count', 'carts_count')
     search_fields = ('name',)
     list_filter = ('author', 'name', 'tags')
     inlines = [RecipeIngredientAdmin, RecipeTagAdmin]
 
-    def in_favorited(self, obj):
-        return Recipe.objects.filter(favorite_recipes__recipe=obj).count()
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term), False
 
-    in_favorited.short_description = 'Количество добавлений в Избранное'
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            # Копии старого изображения не отдаются, пока новое
+            # обрабатывается.
+            obj.image_hash = ''
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Recipe.objects.filter(pk=form.instance.pk).update_derived_fields()
+        if 'image' in form.changed_data and form.instance.image:
+            schedule_image_processing(form.instance.pk)
 
     def ingredients(self, obj):
         return obj.recipe_ing.all()
@@ -61,3 +77,9 @@ class CartAdmin(admin.ModelAdmin):
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+    list_select_related = ('user', 'ingredient')
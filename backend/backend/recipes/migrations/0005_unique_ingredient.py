@@ -0,0 +1,66 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:19
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    # order_by() убирает ordering модели из GROUP BY.
+    duplicates = Ingredient.objects.order_by().values(
+        'name', 'measurement_unit'
+    ).annotate(keep=Min('pk'), total=Count('pk')).filter(total__gt=1)
+    for group in duplicates:
+        keep = group['keep']
+        others = Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']
+        ).exclude(pk=keep)
+        # В рецепте с несколькими копиями ингредиента количества
+        # складываются в одну строку, остальные строки удаляются.
+        rows = defaultdict(list)
+        for row in RecipeIngredient.objects.filter(
+            ingredient__name=group['name'],
+            ingredient__measurement_unit=group['measurement_unit']
+        ).order_by('pk'):
+            rows[row.recipe_id].append(row)
+        for recipe_rows in rows.values():
+            kept = next(
+                (row for row in recipe_rows if row.ingredient_id == keep),
+                recipe_rows[0]
+            )
+            kept.amount = sum(row.amount for row in recipe_rows)
+            kept.ingredient_id = keep
+            RecipeIngredient.objects.filter(pk__in=[
+                row.pk for row in recipe_rows if row is not kept
+            ]).delete()
+            kept.save()
+        for item in ShoppingListItem.objects.filter(ingredient__in=others):
+            kept, _ = ShoppingListItem.objects.get_or_create(
+                user_id=item.user_id, ingredient_id=keep,
+                defaults={'amount': 0}
+            )
+            kept.amount += item.amount
+            kept.save()
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_shopping_list_item'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique ingredient'),
+        ),
+    ]
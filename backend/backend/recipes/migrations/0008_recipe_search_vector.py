@@ -0,0 +1,51 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:32
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+FILL_VECTORS = """
+UPDATE recipes_recipe r SET search_vector =
+    setweight(to_tsvector(%(config)s, COALESCE(r.name, '')), 'A')
+    || setweight(to_tsvector(%(config)s, COALESCE(r.text, '')), 'B')
+    || setweight(to_tsvector(%(config)s, COALESCE((
+        SELECT string_agg(i.name, ' ')
+        FROM recipes_recipeingredient ri
+        JOIN recipes_ingredient i ON i.id = ri.ingredient_id
+        WHERE ri.recipe_id = r.id
+    ), '')), 'C')
+"""
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        FILL_VECTORS, {'config': settings.SEARCH_CONFIG}
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector '
+        'ON recipes_recipe USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipes_recipe_search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
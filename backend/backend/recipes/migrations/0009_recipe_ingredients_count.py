@@ -0,0 +1,34 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_ingredients_count(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    counts = RecipeIngredient.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(total=Count('pk')).values('total')
+    Recipe.objects.update(ingredients_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество ингредиентов'),
+        ),
+        migrations.AddIndex(
+            model_name='recipeingredient',
+            index=models.Index(fields=['ingredient', 'recipe'], name='ingredient_recipes_idx'),
+        ),
+        migrations.RunPython(fill_ingredients_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_tag_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Хеш изображения'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+FILL_TIMELINES = """
+INSERT INTO {timeline} (user_id, recipe_id, pub_date)
+SELECT user_id, recipe_id, pub_date FROM (
+    SELECT f.user_id, r.id AS recipe_id, r.pub_date, ROW_NUMBER() OVER (
+        PARTITION BY f.user_id ORDER BY r.pub_date DESC, r.id DESC
+    ) AS position
+    FROM {follow} f JOIN {recipe} r ON r.author_id = f.author_id
+) ranked WHERE position <= %s
+"""
+
+
+def fill_timelines(apps, schema_editor):
+    recipe = apps.get_model('recipes', 'Recipe')
+    schema_editor.execute(FILL_TIMELINES.format(
+        timeline=apps.get_model('recipes', 'TimelineEntry')._meta.db_table,
+        follow=apps.get_model('users', 'Follow')._meta.db_table,
+        recipe=recipe._meta.db_table
+    ), (settings.FEED_TIMELINE_SIZE, ))
+    recipe.objects.update(fanned_out=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0011_recipe_image_hash'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='fanned_out',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Разослан в ленты подписчиков'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(fanned_out=False), fields=['author', '-pub_date', '-id'], name='recipe_not_fanned_out_idx'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='recipes.Recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique timeline entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:07
+
+from django.db import migrations, models
+import django.utils.timezone
+
+from core.ranking import update_scores
+
+
+def fill_scores(apps, schema_editor):
+    update_scores(
+        recipe_model=apps.get_model('recipes', 'Recipe'),
+        event_models=(
+            apps.get_model('recipes', 'Favorite'),
+            apps.get_model('recipes', 'Cart'),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Добавлен'),
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Добавлен'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='popular_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Рейтинг популярности'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Рейтинг в трендах'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-popular_score', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-id'], name='recipe_trending_idx'),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:18
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_similar_recipe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='carbs',
+            field=models.FloatField(blank=True, null=True, verbose_name='Углеводы, г'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='fat',
+            field=models.FloatField(blank=True, null=True, verbose_name='Жиры, г'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='kcal',
+            field=models.FloatField(blank=True, null=True, verbose_name='Калорийность, ккал'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='price',
+            field=models.FloatField(blank=True, null=True, verbose_name='Цена'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='protein',
+            field=models.FloatField(blank=True, null=True, verbose_name='Белки, г'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='carbs',
+            field=models.FloatField(editable=False, null=True, verbose_name='Углеводы, г'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='fat',
+            field=models.FloatField(editable=False, null=True, verbose_name='Жиры, г'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='kcal',
+            field=models.FloatField(editable=False, null=True, verbose_name='Калорийность, ккал'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='price',
+            field=models.FloatField(editable=False, null=True, verbose_name='Стоимость'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='protein',
+            field=models.FloatField(editable=False, null=True, verbose_name='Белки, г'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='servings',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Порций'),
+        ),
+    ]
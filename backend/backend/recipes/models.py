@@ -1,8 +1,47 @@
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, SearchVectorField
+)
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models
+from django.db.models import (
+    Count, Exists, F, OuterRef, Prefetch, Q, Subquery
+)
+from django.db.models.functions import Coalesce, Upper
+from django.utils import timezone
 
+from core.units import NUTRITION_FIELDS, nutrition_portions
 from users.models import User
 
+IMAGE_DIR = 'recipes'
+
+
+def image_variant_name(image_hash, variant):
+    """Путь к WebP-копии изображения; имя зависит только от содержимого."""
+    return f'{IMAGE_DIR}/{image_hash[:2]}/{image_hash}-{variant}.webp'
+
+
+class IngredientQuerySet(models.QuerySet):
+
+    def autocomplete(self, name, limit):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        # Сортировка по UPPER(name), а не по name: иначе планировщик идёт
+        # по уникальному индексу и отбрасывает строки вместо поиска по
+        # индексам из миграции 0006.
+        ordering = Upper('name')
+        prefix = list(
+            self.filter(name__istartswith=name).order_by(ordering)[:limit]
+        )
+        if len(prefix) == limit:
+            return prefix
+        return prefix + list(
+            self.filter(name__icontains=name).exclude(
+                name__istartswith=name
+            ).order_by(ordering)[:limit - len(prefix)]
+        )
+
 
 class Ingredient(models.Model):
     name = models.CharField('Название ингредиента', max_length=255)
@@ -10,11 +49,25 @@ class Ingredient(models.Model):
         'Единица измерения',
         max_length=50
     )
+    # На 100 г или 100 мл, для остальных единиц - на одну единицу.
+    kcal = models.FloatField('Калорийность, ккал', null=True, blank=True)
+    protein = models.FloatField('Белки, г', null=True, blank=True)
+    fat = models.FloatField('Жиры, г', null=True, blank=True)
+    carbs = models.FloatField('Углеводы, г', null=True, blank=True)
+    price = models.FloatField('Цена', null=True, blank=True)
+
+    objects = IngredientQuerySet.as_manager()
 
     class Meta:
         ordering = ('pk',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique ingredient'
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -37,6 +90,174 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def update_derived_fields(self):
+        """Пересчитывает всё, что хранится в рецепте по его ингредиентам."""
+        self.update_ingredients_count()
+        self.update_nutrition()
+        self.update_search_vector()
+
+    def update_ingredients_count(self):
+        counts = RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            total=Count('pk')
+        ).values('total')
+        return self.order_by().update(
+            ingredients_count=Coalesce(Subquery(counts), 0)
+        )
+
+    def update_nutrition(self):
+        """
+        Калорийность, БЖУ и стоимость рецепта по ингредиентам. Если
+        у какого-то ингредиента значения нет, сумма остаётся пустой.
+
+        Один UPDATE готовым SQL: через ORM пять подзапросов с CASE по
+        единицам собираются дольше, чем выполняются.
+        """
+        recipes, params = self.order_by().values('pk').query.sql_with_params()
+        portion, portion_params = nutrition_portions(
+            'ri.amount', 'i.measurement_unit'
+        )
+        table = self.model._meta.db_table
+        items = (
+            f'{RecipeIngredient._meta.db_table} ri '
+            f'JOIN {Ingredient._meta.db_table} i ON i.id = ri.ingredient_id'
+        )
+        totals = {
+            field: (
+                f'CASE WHEN COUNT(ri.id) = COUNT(i.{field}) '
+                f'THEN SUM(i.{field} * {portion}) END'
+            )
+            for field in NUTRITION_FIELDS
+        }
+        if connection.vendor == 'postgresql':
+            # Коррелированные подзапросы PostgreSQL выполняет хеш-join
+            # по всем ингредиентам на каждый рецепт, а группировка
+            # проходит по составу рецептов один раз.
+            columns = ', '.join(
+                f'{total} AS {field}' for field, total in totals.items()
+            )
+            assignments = ', '.join(f'{field} = s.{field}' for field in totals)
+            sql = (
+                f'UPDATE {table} SET {assignments} FROM ('
+                f'SELECT r.id, {columns} FROM {table} r '
+                f'LEFT JOIN ({items}) ON ri.recipe_id = r.id '
+                f'WHERE r.id IN ({recipes}) GROUP BY r.id'
+                f') s WHERE {table}.id = s.id'
+            )
+        else:
+            assignments = ', '.join(
+                f'{field} = (SELECT {total} FROM {items} '
+                f'WHERE ri.recipe_id = {table}.id)'
+                for field, total in totals.items()
+            )
+            sql = f'UPDATE {table} SET {assignments} WHERE id IN ({recipes})'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql, portion_params * len(NUTRITION_FIELDS) + list(params)
+            )
+            return cursor.rowcount
+
+    def cookable(self, ingredient_ids, max_missing=0):
+        """
+        Рецепты, для которых из ingredient_ids не хватает не более
+        max_missing ингредиентов: сначала самые полные.
+        """
+        return self.filter(
+            recipe_ing__ingredient__in=ingredient_ids
+        ).annotate(
+            matched_count=Count('recipe_ing')
+        ).annotate(
+            missing_count=F('ingredients_count') - F('matched_count')
+        ).filter(
+            missing_count__lte=max_missing
+        ).order_by('missing_count', '-matched_count', '-pub_date', '-id')
+
+    def with_tags(self, tags, match_all=False):
+        """
+        Рецепты с любым из тегов или, при match_all, со всеми сразу.
+
+        Фильтр через EXISTS не размножает строки рецептов, поэтому
+        DISTINCT не нужен.
+        """
+        if not match_all:
+            return self.annotate(has_tags=Exists(RecipeTag.objects.filter(
+                recipe=OuterRef('pk'), tag__in=tags
+            ))).filter(has_tags=True)
+        queryset = self
+        for tag in tags:
+            name = f'has_tag_{tag.pk}'
+            queryset = queryset.annotate(**{name: Exists(
+                RecipeTag.objects.filter(recipe=OuterRef('pk'), tag=tag)
+            )}).filter(**{name: True})
+        return queryset
+
+    def update_search_vector(self):
+        """Пересчитывает поисковый вектор; только для PostgreSQL."""
+        if connection.vendor != 'postgresql':
+            return 0
+        config = settings.SEARCH_CONFIG
+        ingredient_names = RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+        return self.order_by().update(search_vector=(
+            SearchVector('name', weight='A', config=config)
+            + SearchVector('text', weight='B', config=config)
+            + SearchVector(
+                Subquery(ingredient_names), weight='C', config=config
+            )
+        ))
+
+    def search(self, text):
+        """
+        Поиск по названию, описанию и ингредиентам.
+
+        На PostgreSQL - по поисковому вектору с сортировкой по рангу,
+        на остальных базах - простым icontains.
+        """
+        if connection.vendor != 'postgresql':
+            return self.filter(
+                Q(name__icontains=text)
+                | Q(text__icontains=text)
+                | Q(id__in=RecipeIngredient.objects.filter(
+                    ingredient__name__icontains=text
+                ).values('recipe'))
+            )
+        query = SearchQuery(text, config=settings.SEARCH_CONFIG)
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-pub_date', '-id')
+
+    def with_read_payload(self):
+        """Автор, теги и ингредиенты для страницы рецептов."""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ing',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+
+    def with_user_flags(self, user):
+        """Флаги избранного и корзины для пользователя одним запросом."""
+        if user.is_anonymous:
+            return self
+        return self.annotate(
+            favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            in_shopping_cart=Exists(Cart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
+        )
+
+
 class Recipe(models.Model):
     """Рецепт пользователя."""
     tags = models.ManyToManyField(Tag, through='RecipeTag')
@@ -63,21 +284,169 @@ class Recipe(models.Model):
         'Время приготовления',
         validators=[MinValueValidator(1)]
     )
-    is_favorited = models.BooleanField(default=False)
-    is_in_shopping_cart = models.BooleanField(default=False)
+    servings = models.PositiveSmallIntegerField(
+        'Порций',
+        default=1,
+        validators=[MinValueValidator(1)]
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0
+    )
+    carts_count = models.PositiveIntegerField(
+        'В списках покупок',
+        default=0
+    )
     pub_date = models.DateTimeField(
         'Дата публикации',
-        auto_now=True,
-        db_index=True)
+        auto_now_add=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    ingredients_count = models.PositiveIntegerField(
+        'Количество ингредиентов',
+        default=0,
+        editable=False
+    )
+    image_hash = models.CharField(
+        'Хеш изображения',
+        max_length=64,
+        blank=True,
+        editable=False
+    )
+    fanned_out = models.BooleanField(
+        'Разослан в ленты подписчиков',
+        default=False,
+        editable=False
+    )
+    popular_score = models.FloatField(
+        'Рейтинг популярности',
+        default=0,
+        editable=False
+    )
+    trending_score = models.FloatField(
+        'Рейтинг в трендах',
+        default=0,
+        editable=False
+    )
+    kcal = models.FloatField('Калорийность, ккал', null=True, editable=False)
+    protein = models.FloatField('Белки, г', null=True, editable=False)
+    fat = models.FloatField('Жиры, г', null=True, editable=False)
+    carbs = models.FloatField('Углеводы, г', null=True, editable=False)
+    price = models.FloatField('Стоимость', null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_feed_idx'
+            ),
+            # Рецепты, которые подмешиваются в ленты при чтении.
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_not_fanned_out_idx',
+                condition=Q(fanned_out=False)
+            ),
+            models.Index(
+                fields=['-popular_score', '-id'],
+                name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=['-trending_score', '-id'],
+                name='recipe_trending_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name
 
+    @property
+    def image_variants(self):
+        """URL уменьшенных копий; пусто, пока они не готовы."""
+        if not self.image_hash:
+            return {}
+        return {
+            variant: default_storage.url(
+                image_variant_name(self.image_hash, variant)
+            )
+            for variant in settings.RECIPE_IMAGE_VARIANTS
+        }
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='timeline',
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        related_name='timeline_entries',
+        on_delete=models.CASCADE
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique timeline entry'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
+
+
+class SimilarRecipe(models.Model):
+    """Похожий рецепт из top-K по ингредиентам и тегам."""
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        related_name='neighbours',
+        on_delete=models.CASCADE
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        verbose_name='Похожий рецепт',
+        related_name='similar_to',
+        on_delete=models.CASCADE
+    )
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique similar recipe'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=['recipe', '-score'],
+                name='similar_recipes_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar}'
+
 
 class RecipeTag(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
@@ -92,6 +461,9 @@ class RecipeTag(models.Model):
                 name='unique tag_in_recipe'
             ),
         )
+        indexes = (
+            models.Index(fields=['tag', 'recipe'], name='tag_recipes_idx'),
+        )
 
     def __str__(self):
         return f'{self.recipe} {self.tag}'
@@ -119,12 +491,20 @@ class RecipeIngredient(models.Model):
                 name='unique ingredient_in_recipe'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=['ingredient', 'recipe'],
+                name='ingredient_recipes_idx'
+            ),
+        )
 
     def __str__(self):
         return f'{self.recipe} {self.ingredient}'
 
 
 class Cart(models.Model):
+    counter_field = 'carts_count'
+
     user = models.ForeignKey(
         User,
         verbose_name='Пользователь',
@@ -137,6 +517,7 @@ class Cart(models.Model):
         related_name='cart_recipes',
         on_delete=models.CASCADE
     )
+    created = models.DateTimeField('Добавлен', default=timezone.now)
 
     class Meta:
         verbose_name = 'Корзина'
@@ -153,6 +534,8 @@ class Cart(models.Model):
 
 
 class Favorite(models.Model):
+    counter_field = 'favorites_count'
+
     user = models.ForeignKey(
         User,
         related_name='favorite_recipes',
@@ -163,6 +546,7 @@ class Favorite(models.Model):
         related_name='favorite_recipes',
         on_delete=models.CASCADE
     )
+    created = models.DateTimeField('Добавлен', default=timezone.now)
     is_favorite = models.BooleanField(default=False)
 
     class Meta:
@@ -177,3 +561,33 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'{self.recipe}'
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по всем рецептам из корзины пользователя."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='shopping_list',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE
+    )
+    amount = models.FloatField('Количество')
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique shopping_list_item'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient}'
@@ -1,10 +1,16 @@
 import webcolors
-from drf_extra_fields.fields import Base64ImageField
+from django.db import transaction
 from rest_framework import serializers
 
-from users.serializers import UserSerializer, AnonymousUserSerializer
+from core.background import run_after_commit
+from core.fields import ImageVariantsField, LimitedBase64ImageField
+from core.images import schedule_image_processing
+from core.similarity import refresh_similar_recipes
+from core.units import NUTRITION_FIELDS
+from core.utils import change_in_shopping_lists, lock_recipes
+from users.models import Follow
 from .models import (
-    Cart, Favorite, Ingredient, Recipe, RecipeIngredient, Tag
+    Cart, Favorite, Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
 )
 
 
@@ -27,9 +33,39 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('name', 'measurement_unit', 'id')
 
 
+class PrimaryKeyListField(serializers.ListField):
+    """Список первичных ключей, объекты загружаются одним запросом."""
+
+    child = serializers.IntegerField(min_value=1)
+
+    def __init__(self, queryset, **kwargs):
+        self.queryset = queryset
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        pks = super().to_internal_value(data)
+        objects = self.queryset.in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                raise serializers.ValidationError(
+                    f'Недопустимый первичный ключ "{pk}" - '
+                    f'объект не существует.'
+                )
+        return [objects[pk] for pk in pks]
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Рецепты для массового добавления в корзину или избранное."""
+    recipes = PrimaryKeyListField(
+        queryset=Recipe.objects.only('pk'),
+        allow_empty=False,
+        max_length=100
+    )
+
+
 class IngredientRecipeSerializer(serializers.ModelSerializer):
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = RecipeIngredient
@@ -47,59 +83,167 @@ class TagSerializer(serializers.ModelSerializer):
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
 
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
-    )
-    image = Base64ImageField()
+    tags = PrimaryKeyListField(queryset=Tag.objects.all())
+    image = LimitedBase64ImageField()
     ingredients = IngredientRecipeSerializer(many=True)
 
     class Meta:
         model = Recipe
         fields = ('tags', 'name', 'image',
-                  'text', 'cooking_time', 'ingredients'
+                  'text', 'cooking_time', 'servings', 'ingredients'
                   )
 
     @staticmethod
-    def _create_tags(tags, recipe):
-        for tag in tags:
-            recipe.tags.add(tag)
+    def _sync_tags(tags, recipe, existing=()):
+        """
+        Добавляет новые и удаляет лишние теги рецепта; возвращает,
+        изменился ли набор тегов.
+        """
+        incoming = {tag.pk for tag in tags}
+        existing = set(existing)
+        removed, added = existing - incoming, incoming - existing
+        if removed:
+            RecipeTag.objects.filter(recipe=recipe, tag__in=removed).delete()
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag_id=tag) for tag in added
+        )
+        return bool(removed or added)
 
     @staticmethod
-    def _create_ingredients(ingredients, recipe):
-        RecipeIngredient.objects.bulk_create(
-            [RecipeIngredient(
-                ingredient=ingredient['id'],
-                recipe=recipe,
-                amount=ingredient['amount']
-            ) for ingredient in ingredients]
-        )
+    def _sync_ingredients(ingredients, recipe, existing=()):
+        """
+        Сводит ингредиенты рецепта к переданным: не более одного
+        удаления, вставки и обновления. Неизменённые строки сохраняют
+        свои первичные ключи. Возвращает изменения количеств
+        в виде {ингредиент: разница}.
+        """
+        existing = {item.ingredient_id: item for item in existing}
+        to_create, to_update, deltas = [], [], {}
+        for ingredient in ingredients:
+            ingredient_id, amount = ingredient['id'].pk, ingredient['amount']
+            item = existing.pop(ingredient_id, None)
+            if item is None:
+                to_create.append(RecipeIngredient(
+                    ingredient=ingredient['id'], recipe=recipe, amount=amount
+                ))
+                deltas[ingredient_id] = amount
+            elif item.amount != amount:
+                deltas[ingredient_id] = amount - item.amount
+                item.amount = amount
+                to_update.append(item)
+        for ingredient_id, item in existing.items():
+            deltas[ingredient_id] = -item.amount
+        if existing:
+            RecipeIngredient.objects.filter(
+                pk__in=[item.pk for item in existing.values()]
+            ).delete()
+        if to_create:
+            RecipeIngredient.objects.bulk_create(to_create)
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ['amount'])
+        return deltas
 
     def create(self, validated_data):
         validated_data['author'] = self.context['request'].user
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(**validated_data)
-        self._create_ingredients(ingredients, recipe)
-        self._create_tags(tags, recipe)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(**validated_data)
+            self._sync_ingredients(ingredients, recipe)
+            self._sync_tags(tags, recipe)
+            Recipe.objects.filter(pk=recipe.pk).update_derived_fields()
+            if recipe.image:
+                schedule_image_processing(recipe.pk)
+            run_after_commit(refresh_similar_recipes, recipe.pk)
         return recipe
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            # Временный файл из base64 уже перенесён в хранилище.
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
+
     def update(self, instance, validated_data):
-        RecipeIngredient.objects.filter(recipe=instance).all().delete()
-        tags = validated_data.get('tags')
-        self._create_tags(tags, instance)
-        ingredients = validated_data.get('ingredients')
-        self._create_ingredients(ingredients, instance)
-        return super().update(instance, validated_data)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        composition_changed = False
+        with transaction.atomic():
+            lock_recipes([instance.pk])
+            # Счётчики, рейтинги и обработанное изображение меняются
+            # в обход сериализатора; save() не должен вернуть старые.
+            instance.refresh_from_db(fields=[
+                field.attname for field in Recipe._meta.concrete_fields
+                if not field.primary_key and field.name not in validated_data
+            ])
+            if tags is not None:
+                composition_changed = self._sync_tags(
+                    tags, instance, RecipeTag.objects.filter(
+                        recipe=instance
+                    ).values_list('tag', flat=True)
+                )
+            if ingredients is not None:
+                existing = list(RecipeIngredient.objects.select_for_update(
+                ).filter(recipe=instance))
+                composition_changed |= (
+                    {item.ingredient_id for item in existing}
+                    != {item['id'].pk for item in ingredients}
+                )
+                change_in_shopping_lists(instance, self._sync_ingredients(
+                    ingredients, instance, existing
+                ))
+            if validated_data.get('image'):
+                # Копии старого изображения не отдаются, пока новое
+                # обрабатывается.
+                validated_data['image_hash'] = ''
+            recipe = super().update(instance, validated_data)
+            Recipe.objects.filter(pk=recipe.pk).update_derived_fields()
+            if validated_data.get('image'):
+                schedule_image_processing(recipe.pk)
+            if composition_changed:
+                run_after_commit(refresh_similar_recipes, recipe.pk)
+        return recipe
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        # Перечитываем рецепт с prefetch, иначе на каждый ингредиент
+        # ответа уходит отдельный запрос.
+        instance = Recipe.objects.with_read_payload().with_user_flags(
+            request.user
+        ).get(pk=instance.pk)
         return RecipeReadSerializer(instance, context=context).data
 
+    def validate_ingredients(self, ingredients):
+        """Подставляет объекты ингредиентов одним запросом."""
+        ids = [ingredient['id'] for ingredient in ingredients]
+        objects = Ingredient.objects.in_bulk(ids)
+        for ingredient_id in ids:
+            if ingredient_id not in objects:
+                raise serializers.ValidationError(
+                    f'Недопустимый первичный ключ "{ingredient_id}" - '
+                    f'объект не существует.'
+                )
+        for ingredient in ingredients:
+            ingredient['id'] = objects[ingredient['id']]
+        return ingredients
+
     def validate(self, data):
-        print(data['ingredients'][0]['amount'])
-        ingredients = data['ingredients']
+        # При частичном PATCH проверяются только переданные поля.
+        if 'ingredients' in data:
+            self._validate_ingredient_items(data['ingredients'])
+        if 'tags' in data:
+            self._validate_tag_items(data['tags'])
+        if 'cooking_time' in data and int(data['cooking_time']) <= 0:
+            raise serializers.ValidationError([
+                'Время приготовление должно быть больше нуля'
+            ])
+        return data
+
+    @staticmethod
+    def _validate_ingredient_items(ingredients):
         if not ingredients:
             raise serializers.ValidationError([
                 'Выберите ингредиент!'
@@ -117,7 +261,9 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError([
                     'Количество должно быть больше нуля!'
                 ])
-        tags = data['tags']
+
+    @staticmethod
+    def _validate_tag_items(tags):
         if not tags:
             raise serializers.ValidationError([
                 'Нужно выбрать хотя бы один тэг!'
@@ -130,111 +276,122 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 ])
             tags_list.append(tag)
 
-        cooking_time = data['cooking_time']
-        if int(cooking_time) <= 0:
-            raise serializers.ValidationError([
-                'Время приготовление должно быть больше нуля'
-            ])
-
-        return data
-
 
-class IngredientRecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(serializers.BaseSerializer):
+    """
+    Рецепт для чтения.
 
-    id = serializers.SerializerMethodField()
-    name = serializers.SerializerMethodField()
-    measurement_unit = serializers.SerializerMethodField()
-
-    class Meta:
-        model = RecipeIngredient
-        fields = ('id', 'name', 'measurement_unit', 'amount')
+    Словарь собирается напрямую из строк, загруженных
+    with_read_payload() и with_user_flags(), без отражения полей
+    модели и вложенных сериализаторов. Для анонима все флаги false.
+    """
 
-    def get_id(self, obj):
-        return obj.ingredient.id
+    def to_representation(self, recipe):
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        authenticated = user is not None and user.is_authenticated
+        author = recipe.author
+        image = None
+        if recipe.image:
+            image = recipe.image.url
+            if request is not None:
+                image = request.build_absolute_uri(image)
+        image_variants = recipe.image_variants
+        if request is not None:
+            image_variants = {
+                variant: request.build_absolute_uri(url)
+                for variant, url in image_variants.items()
+            }
+        return {
+            'tags': [
+                {
+                    'id': tag.id,
+                    'name': tag.name,
+                    'slug': tag.slug,
+                    'color': tag.color,
+                }
+                for tag in recipe.tags.all()
+            ],
+            'id': recipe.id,
+            'author': {
+                'username': author.username,
+                'id': author.id,
+                'email': author.email,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+                'is_subscribed': (
+                    authenticated and self._is_subscribed(user, author)
+                ),
+            },
+            'ingredients': [
+                {
+                    'id': item.ingredient_id,
+                    'name': item.ingredient.name,
+                    'measurement_unit': item.ingredient.measurement_unit,
+                    'amount': item.amount,
+                }
+                for item in recipe.recipe_ing.all()
+            ],
+            'is_favorited': authenticated and self._flag(
+                recipe, 'favorited', Favorite, user
+            ),
+            'is_in_shopping_cart': authenticated and self._flag(
+                recipe, 'in_shopping_cart', Cart, user
+            ),
+            'name': recipe.name,
+            'image': image,
+            'image_variants': image_variants,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'servings': recipe.servings,
+            'nutrition': self._nutrition(recipe),
+        }
 
-    def get_name(self, obj):
-        return obj.ingredient.name
+    @staticmethod
+    def _nutrition(recipe):
+        """Суммы, посчитанные при записи рецепта, и они же на порцию."""
+        total = {field: getattr(recipe, field) for field in NUTRITION_FIELDS}
+        return {
+            'total': {
+                field: None if value is None else round(value, 2)
+                for field, value in total.items()
+            },
+            'per_serving': {
+                field: None if value is None else round(
+                    value / recipe.servings, 2
+                )
+                for field, value in total.items()
+            },
+        }
+
+    def _is_subscribed(self, user, author):
+        subscriptions = self.context.get('subscriptions')
+        if subscriptions is not None:
+            return author.id in subscriptions
+        return Follow.objects.filter(user=user, author=author).exists()
 
-    def get_measurement_unit(self, obj):
-        return obj.ingredient.measurement_unit
+    @staticmethod
+    def _flag(recipe, annotation, model, user):
+        if hasattr(recipe, annotation):
+            return getattr(recipe, annotation)
+        return model.objects.filter(user=user, recipe=recipe).exists()
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class LightRecipeSerializer(serializers.ModelSerializer):
 
-    tags = TagSerializer(many=True, read_only=True)
-    author = UserSerializer()
-    ingredients = IngredientRecipeReadSerializer(
-        source='recipe_ing', many=True, read_only=True
-    )
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'id', 'author',
-                  'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time'
-                  )
-
-    def get_is_favorited(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        favorite = Favorite.objects.filter(
-            user=user, recipe=obj
-        )
-        return favorite.exists()
-
-    def get_is_in_shopping_cart(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        recipe_in_cart = Cart.objects.filter(
-            user=user, recipe=obj
-        )
-        return recipe_in_cart.exists()
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time',)
 
 
-class AnonymousRecipeReadSerializer(serializers.ModelSerializer):
-
-    tags = TagSerializer(many=True, read_only=True)
-    author = AnonymousUserSerializer()
-    ingredients = IngredientRecipeReadSerializer(
-        source='recipe_ing', many=True, read_only=True
-    )
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+class CookableRecipeSerializer(LightRecipeSerializer):
 
-    class Meta:
-        model = Recipe
-        fields = ('tags', 'id', 'author',
-                  'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time'
-                  )
+    matched_count = serializers.ReadOnlyField()
+    missing_count = serializers.ReadOnlyField()
 
-    def get_is_favorited(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        favorite = Favorite.objects.filter(
-            user=user, recipe=obj
+    class Meta(LightRecipeSerializer.Meta):
+        fields = LightRecipeSerializer.Meta.fields + (
+            'matched_count', 'missing_count'
         )
-        return favorite.exists()
-
-    def get_is_in_shopping_cart(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        recipe_in_cart = Cart.objects.filter(
-            user=user, recipe=obj
-        )
-        return recipe_in_cart.exists()
-
-
-class LightRecipeSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time',)
@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.background import run_after_commit
+from core.cache import bump_version
+from core.timeline import fan_out_recipe
+from users.models import User
+from .models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(**kwargs):
+    transaction.on_commit(lambda: bump_version('tags'))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    transaction.on_commit(lambda: bump_version('ingredients'))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+@receiver((post_save, post_delete), sender=RecipeTag)
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_recipes(**kwargs):
+    transaction.on_commit(lambda: bump_version('recipes'))
+
+
+@receiver((post_save, post_delete), sender=User)
+def invalidate_recipe_authors(update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login, в ленте его нет.
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(lambda: bump_version('recipes'))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes(instance, created, **kwargs):
+    if not created:
+        recipes = Recipe.objects.filter(recipe_ing__ingredient=instance)
+        recipes.update_nutrition()
+        recipes.update_search_vector()
+
+
+def update_derived_fields(recipe_ids):
+    Recipe.objects.filter(pk__in=recipe_ids).update_derived_fields()
+
+
+@receiver(pre_delete, sender=Ingredient)
+def update_recipes_without_ingredient(instance, **kwargs):
+    # Строки RecipeIngredient удаляются каскадом, без своих сигналов
+    # для рецептов, поэтому рецепты запоминаются до удаления.
+    recipe_ids = list(Recipe.objects.filter(
+        recipe_ing__ingredient=instance
+    ).values_list('pk', flat=True).distinct())
+    if recipe_ids:
+        run_after_commit(update_derived_fields, recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_new_recipe(instance, created, raw=False, **kwargs):
+    if created and not raw:
+        run_after_commit(fan_out_recipe, instance.pk)
@@ -0,0 +1,351 @@
+import base64
+import io
+import os
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from PIL import Image
+from rest_framework.test import APIClient
+
+from core.background import run_after_commit
+from core.benchmark import IMAGE
+from core.timeline import fan_out_recipe
+from users.models import Follow, User
+from .models import (
+    Cart, Favorite, Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag,
+    TimelineEntry
+)
+from .serializers import RecipeCreateSerializer
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class RecipeListQueriesTest(TestCase):
+    """Число запросов страницы рецептов не зависит от её размера."""
+
+    # Авторизованный: рецепты, подписки, теги, ингредиенты, count.
+    AUTHENTICATED_QUERIES = 5
+    # Аноним: без запроса подписок.
+    ANONYMOUS_QUERIES = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for i in range(3)
+        ]
+        cls.user = authors[0]
+        tags = [
+            Tag.objects.create(name=f'тег{i}', slug=f'tag{i}', color='red')
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'ингредиент{i}',
+                                      measurement_unit='г')
+            for i in range(10)
+        ]
+        recipes = []
+        for i in range(12):
+            recipe = Recipe.objects.create(
+                name=f'рецепт{i}', author=authors[i % len(authors)],
+                text='Описание', cooking_time=10
+            )
+            RecipeTag.objects.create(recipe=recipe, tag=tags[i % len(tags)])
+            for j in range(3):
+                RecipeIngredient.objects.create(
+                    recipe=recipe,
+                    ingredient=ingredients[(i + j) % len(ingredients)],
+                    amount=j + 1
+                )
+            recipes.append(recipe)
+        Favorite.objects.create(user=cls.user, recipe=recipes[1])
+        Cart.objects.create(user=cls.user, recipe=recipes[2])
+        Follow.objects.create(user=cls.user, author=authors[1])
+
+    def _assert_page_queries(self, client, expected):
+        for limit in (3, 10):
+            # Анонимная лента кэшируется целиком, замеряем запросы к базе.
+            cache.clear()
+            with self.assertNumQueries(expected):
+                response = client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), limit)
+
+    def test_authenticated_page_queries(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self._assert_page_queries(client, self.AUTHENTICATED_QUERIES)
+
+    def test_anonymous_page_queries(self):
+        self._assert_page_queries(APIClient(), self.ANONYMOUS_QUERIES)
+
+
+class RecipePartialUpdateTest(TestCase):
+    """PATCH с частью полей не трогает остальные."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        cls.tag = Tag.objects.create(name='тег', slug='tag', color='red')
+        cls.ingredient = Ingredient.objects.create(
+            name='ингредиент', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            name='рецепт', author=cls.user, text='Описание', cooking_time=10
+        )
+        RecipeTag.objects.create(recipe=cls.recipe, tag=cls.tag)
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=5
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_patch_name_only(self):
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/', {'name': 'новое'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'новое')
+        self.assertEqual(
+            [tag['id'] for tag in response.json()['tags']], [self.tag.pk]
+        )
+        self.assertEqual(
+            [(item['id'], item['amount'])
+             for item in response.json()['ingredients']],
+            [(self.ingredient.pk, 5)]
+        )
+
+    def test_patch_image_hides_old_variants(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(image_hash='0' * 64)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with self.settings(MEDIA_ROOT=media.name):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/', {'image': IMAGE},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['image_variants'], {})
+
+    def test_put_replaces_recipe(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with self.settings(MEDIA_ROOT=media.name):
+            response = self.client.put(
+                f'/api/recipes/{self.recipe.pk}/', {
+                    'name': 'новое', 'text': 'Текст', 'cooking_time': 5,
+                    'image': IMAGE, 'tags': [self.tag.pk],
+                    'ingredients': [
+                        {'id': self.ingredient.pk, 'amount': 7}
+                    ],
+                },
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'новое')
+        self.assertEqual(response.json()['ingredients'][0]['amount'], 7)
+
+    def test_update_keeps_concurrent_counters(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Cart.objects.create(user=self.user, recipe=self.recipe)
+        Recipe.objects.filter(pk=self.recipe.pk).update(carts_count=1)
+        serializer = RecipeCreateSerializer(
+            stale, data={'name': 'новое'}, partial=True
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipe.pk).carts_count, 1
+        )
+
+    def test_patch_image_with_whitespace(self):
+        # Шум не сжимается: base64 длиннее одного куска декодирования.
+        image = io.BytesIO()
+        Image.frombytes('RGB', (150, 150), os.urandom(150 * 150 * 3)).save(
+            image, 'PNG'
+        )
+        data = base64.b64encode(image.getvalue()).decode()
+        spaced = 'data:image/png;base64,' + ' '.join(
+            data[i:i + 5] for i in range(0, len(data), 5)
+        ) + '\t\n'
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with self.settings(MEDIA_ROOT=media.name):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/', {'image': spaced},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_patch_validates_passed_fields(self):
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/', {'ingredients': []},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeCursorOrderingTest(TestCase):
+    """Курсорная выдача сохраняет сортировку по рейтингу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        for i in range(7):
+            Recipe.objects.create(
+                name=f'рецепт{i}', author=cls.user, text='Описание',
+                cooking_time=10, popular_score=i % 3
+            )
+
+    def test_cursor_pages_follow_ranking(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = '/api/recipes/?ordering=popular&limit=3&cursor='
+        pages = []
+        while url:
+            data = client.get(url).json()
+            pages.extend(recipe['id'] for recipe in data['results'])
+            url = data['next']
+        expected = list(Recipe.objects.order_by(
+            '-popular_score', '-id'
+        ).values_list('pk', flat=True))
+        self.assertEqual(pages, expected)
+
+
+class RecipeLookupTest(TestCase):
+    """Нечисловой id рецепта - 404, а не ошибка сервера."""
+
+    def test_invalid_pk(self):
+        client = APIClient()
+        for url in ('/api/recipes/abc/', '/api/recipes/abc/similar/'):
+            self.assertEqual(client.get(url).status_code, 404)
+
+
+@override_settings(FEED_TIMELINE_SIZE=2)
+class FanOutTest(TestCase):
+    """Рецепт раскладывается по лентам, переполненные обрезаются."""
+
+    def test_fan_out_trims_overflowed_timelines(self):
+        author, reader = [
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for name in ('author', 'reader')
+        ]
+        Follow.objects.create(user=reader, author=author)
+        recipes = [
+            Recipe.objects.create(
+                name=f'рецепт{i}', author=author, text='Описание',
+                cooking_time=10
+            )
+            for i in range(3)
+        ]
+        # В TestCase коммита нет, и сигнал не раскладывает рецепты сам.
+        self.assertFalse(TimelineEntry.objects.exists())
+        for recipe in recipes:
+            fan_out_recipe(recipe.pk)
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=reader).order_by(
+                '-pub_date', '-recipe_id'
+            ).values_list('recipe_id', flat=True)),
+            [recipes[2].pk, recipes[1].pk]
+        )
+        self.assertFalse(Recipe.objects.filter(fanned_out=False).exists())
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class RunAfterCommitTest(SimpleTestCase):
+    """Ошибка задачи после коммита пишется в лог, а не в ответ."""
+
+    def test_inline_task_error_is_logged(self):
+        def fail():
+            raise RuntimeError('boom')
+
+        with self.assertLogs('core.background', 'ERROR'):
+            # Вне транзакции on_commit выполняет задачу сразу.
+            run_after_commit(fail)
+
+
+class ImportNutritionTest(TestCase):
+    """Импорт пересчитывает только рецепты с изменёнными ингредиентами."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        cls.recipes = {}
+        for name in ('мука', 'соль'):
+            ingredient = Ingredient.objects.create(
+                name=name, measurement_unit='г', kcal=100, protein=1,
+                fat=1, carbs=1, price=1
+            )
+            recipe = Recipe.objects.create(
+                name=name, author=author, text='Описание', cooking_time=10
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=100
+            )
+            cls.recipes[name] = recipe
+        Recipe.objects.update(kcal=-1)
+
+    def test_only_updated_ingredients_recount(self):
+        data = tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', encoding='utf-8'
+        )
+        self.addCleanup(data.close)
+        data.write('мука,г,200\nсоль,г,100\nсахар,г,400\n')
+        data.flush()
+        call_command('import_csv', path=data.name, stdout=io.StringIO())
+        kcal = dict(Recipe.objects.values_list('name', 'kcal'))
+        self.assertEqual(kcal['соль'], -1)
+        self.assertNotEqual(kcal['мука'], -1)
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class IngredientDeleteTest(TransactionTestCase):
+    """Удаление ингредиента пересчитывает поля рецептов после коммита."""
+
+    def test_delete_updates_recipes(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        recipe = Recipe.objects.create(
+            name='рецепт', author=author, text='Описание', cooking_time=10
+        )
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент{i}', measurement_unit='г', kcal=100,
+                protein=1, fat=1, carbs=1, price=1
+            )
+            for i in range(2)
+        ]
+        for ingredient in ingredients:
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=100
+            )
+        Recipe.objects.filter(pk=recipe.pk).update_derived_fields()
+        ingredients[0].delete()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredients_count, 1)
+        self.assertEqual(recipe.kcal, 100)
@@ -1,49 +1,117 @@
-from django.http import HttpResponse
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
-from core.utils import get_shopping_list
+from core.cache import get_cached_json
 from core.filters import IngredientFilter, RecipeFilter
-from core.mixins import IngredientsTagsMixin, ListCartFavoriteMixin
+from core.mixins import (
+    IngredientsTagsMixin, ListCartFavoriteMixin, cached_json_response
+)
+from core.pagination import (
+    FeedPagination, LimitPageNumberPagination, RecipePagination
+)
+from core.parsers import LimitedJSONParser, RecipeMultiPartParser
+from core.renderers import SHOPPING_LIST_RENDERERS
+from core.timeline import feed_positions
+from core.utils import (
+    add_recipes, get_cart_nutrition, get_shopping_list,
+    remove_from_shopping_lists, remove_recipes
+)
+from users.models import Follow
 from .models import Cart, Favorite, Ingredient, Recipe, Tag
 from .serializers import (
-    AnonymousRecipeReadSerializer, IngredientSerializer, LightRecipeSerializer,
+    CookableRecipeSerializer,
+    IngredientSerializer, LightRecipeSerializer,
     RecipeCreateSerializer, RecipeReadSerializer,
     TagSerializer
 )
 
 
 class RecipeViewset(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
     permission_classes = (AllowAny, )
-    pagination_class = PageNumberPagination
+    pagination_class = RecipePagination
+    # Нечисловой id - 404 ещё в роутере, а не ValueError в запросе к базе.
+    lookup_value_regex = r'\d+'
+    parser_classes = (LimitedJSONParser, RecipeMultiPartParser)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        return Recipe.objects.with_read_payload().with_user_flags(
+            self.request.user
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        user = self.request.user
+        if user.is_authenticated:
+            context['subscriptions'] = set(
+                Follow.objects.filter(user=user).values_list(
+                    'author_id', flat=True
+                )
+            )
+        return context
+
     def get_serializer_class(self):
-        if self.request.method in ('POST', 'PATCH', 'DELETE'):
+        if self.request.method in ('POST', 'PUT', 'PATCH', 'DELETE'):
             return RecipeCreateSerializer
-        if self.request.user.is_anonymous:
-            return AnonymousRecipeReadSerializer
         return RecipeReadSerializer
 
+    def _feed_cache_variant(self):
+        """Ключ ответа: хост и параметры без учёта их порядка."""
+        params = self.request.query_params
+        normalized = '&'.join(
+            f'{key}={value}'
+            for key in sorted(params)
+            for value in sorted(params.getlist(key))
+        )
+        return hashlib.md5(
+            f'{self.request.get_host()}?{normalized}'.encode()
+        ).hexdigest()
+
+    def list(self, request, *args, **kwargs):
+        # Для анонимов флаги всегда false, и ответ зависит только от
+        # параметров запроса, поэтому отдаётся целиком из кэша.
+        if (request.user.is_authenticated
+                or request.accepted_renderer.format != 'json'):
+            return super().list(request, *args, **kwargs)
+        payload, etag = get_cached_json(
+            'recipes',
+            lambda: JSONRenderer().render(
+                super(RecipeViewset, self).list(
+                    request, *args, **kwargs
+                ).data
+            ),
+            variant=self._feed_cache_variant(),
+            timeout=settings.RECIPE_FEED_CACHE_TIMEOUT
+        )
+        return cached_json_response(request, payload, etag)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            remove_from_shopping_lists(Cart.objects.filter(recipe=instance))
+            instance.delete()
+
     @staticmethod
     def _set_action_for_recipe(model, user, method, pk):
         recipe = get_object_or_404(Recipe, pk=pk)
-        target_recipe = model.objects.filter(
-            user=user,
-            recipe=recipe
-        )
         if method == 'POST':
-            model.objects.create(user=user, recipe=recipe)
+            if not add_recipes(model, user, [recipe.pk]):
+                raise ValidationError('Рецепт уже добавлен.')
             serializer = LightRecipeSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        target_recipe.delete()
+        remove_recipes(model, user, [recipe.pk])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -53,7 +121,6 @@ class RecipeViewset(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated | IsAdminUser, )
     )
     def shopping_cart(self, request, pk):
-        print(request.user, request.method)
         return self._set_action_for_recipe(
             Cart,
             request.user,
@@ -75,36 +142,155 @@ class RecipeViewset(viewsets.ModelViewSet):
             pk
         )
 
-    @action(detail=False, methods=['GET'], url_path='download_shopping_cart')
+    @action(
+        detail=False,
+        methods=['GET'],
+        url_path='cookable',
+        pagination_class=LimitPageNumberPagination
+    )
+    def cookable(self, request):
+        """Что можно приготовить из ?ingredients=1,2,3 (&missing=k)."""
+        try:
+            ingredient_ids = {
+                int(value)
+                for values in request.query_params.getlist('ingredients')
+                for value in values.split(',') if value
+            }
+            max_missing = int(request.query_params.get('missing', 0))
+        except ValueError:
+            raise ValidationError(
+                'ingredients и missing должны быть целыми числами'
+            )
+        if not ingredient_ids:
+            raise ValidationError('Укажите ингредиенты в ingredients')
+        recipes = Recipe.objects.cookable(ingredient_ids, max_missing)
+        page = self.paginate_queryset(recipes)
+        serializer = CookableRecipeSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=['GET'],
+        url_path='similar',
+        pagination_class=None,
+        filter_backends=()
+    )
+    def similar(self, request, pk):
+        """Похожие рецепты по ингредиентам и тегам, ближние сверху."""
+        recipes = Recipe.objects.filter(similar_to__recipe=pk).order_by(
+            '-similar_to__score', '-id'
+        )
+        serializer = LightRecipeSerializer(
+            recipes, many=True, context={'request': request}
+        )
+        if not serializer.data:
+            get_object_or_404(Recipe, pk=pk)
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        url_path='feed',
+        permission_classes=(IsAuthenticated, ),
+        pagination_class=FeedPagination,
+        filter_backends=()
+    )
+    def feed(self, request):
+        """Рецепты авторов из подписок, новые сверху."""
+        positions = self.paginator.paginate_feed(
+            lambda after, limit: feed_positions(request.user, after, limit),
+            request
+        )
+        recipes = self.get_queryset().in_bulk(
+            [pk for _, pk in positions]
+        )
+        serializer = self.get_serializer(
+            [recipes[pk] for _, pk in positions if pk in recipes],
+            many=True
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        url_path='download_shopping_cart',
+        permission_classes=(IsAuthenticated, ),
+        renderer_classes=SHOPPING_LIST_RENDERERS
+    )
     def download_shopping_cart(self, request):
-        user = request.user
-        main_list = get_shopping_list(user)
-        response = HttpResponse(main_list, 'Content-Type: text/plain')
-        response['Content-Disposition'] = 'attachment; filename="Cart.txt"'
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(
+                get_shopping_list(request.user),
+                get_cart_nutrition(request.user)
+            ),
+            content_type=renderer.content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="Cart.{renderer.format}"'
+        )
         return response
 
 
 class IngredientViewset(IngredientsTagsMixin):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
+    cache_name = 'ingredients'
     filter_backends = (DjangoFilterBackend,)
     filter_class = IngredientFilter
+    autocomplete_limit = 20
+    autocomplete_max_limit = 100
+    autocomplete_max_age = 60 * 60
+
+    @action(detail=False, methods=['GET'], url_path='autocomplete')
+    def autocomplete(self, request):
+        name = request.query_params.get('name', '').strip()
+        try:
+            limit = int(
+                request.query_params.get('limit', self.autocomplete_limit)
+            )
+        except ValueError:
+            limit = self.autocomplete_limit
+        limit = min(max(limit, 1), self.autocomplete_max_limit)
+        ingredients = (
+            Ingredient.objects.autocomplete(name, limit) if name else []
+        )
+        serializer = self.get_serializer(ingredients, many=True)
+        response = Response(serializer.data)
+        patch_cache_control(
+            response, public=True, max_age=self.autocomplete_max_age
+        )
+        return response
 
 
 class TagViewset(IngredientsTagsMixin):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    cache_name = 'tags'
 
 
 class ListCartViewSet(ListCartFavoriteMixin):
+    model = Cart
 
     def get_queryset(self):
         user = self.request.user
-        return Recipe.objects.filter(cart_recipes__user=user)
+        return Recipe.objects.with_read_payload().filter(
+            cart_recipes__user=user
+        )
+
+    @action(detail=False, methods=['DELETE'], url_path='clear')
+    def clear(self, request):
+        """Очищает корзину целиком."""
+        return Response({'removed': remove_recipes(Cart, request.user)})
 
 
 class ListFavoriteViewSet(ListCartFavoriteMixin):
+    model = Favorite
 
     def get_queryset(self, ):
         user = self.request.user
-        return Recipe.objects.filter(favorite_recipes__user=user)
+        return Recipe.objects.with_read_payload().filter(
+            favorite_recipes__user=user
+        )
@@ -2,6 +2,7 @@ from django.shortcuts import get_object_or_404
 from djoser.serializers import UserCreateSerializer
 from rest_framework import serializers, status
 
+from core.fields import ImageVariantsField
 from recipes.models import Recipe
 from .models import User, Follow
 
@@ -18,9 +19,15 @@ class UserSerializer(UserCreateSerializer):
                   'last_name', 'password', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        return Follow.objects.filter(
-            user=self.context['request'].user,
-            author=obj).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        subscriptions = self.context.get('subscriptions')
+        if subscriptions is not None:
+            return obj.id in subscriptions
+        user = self.context['request'].user
+        if user.is_anonymous:
+            return False
+        return Follow.objects.filter(user=user, author=obj).exists()
 
 
 class UserProfileSerializer(UserCreateSerializer):
@@ -31,26 +38,13 @@ class UserProfileSerializer(UserCreateSerializer):
                   'last_name', 'password')
 
 
-class AnonymousUserSerializer(UserCreateSerializer):
-
-    is_subscribed = serializers.SerializerMethodField(
-        source='get_is_subscribed'
-    )
-
-    class Meta:
-        model = User
-        fields = ('username', 'id', 'email', 'first_name',
-                  'last_name', 'password', 'is_subscribed')
-
-    def get_is_subscribed(self, obj):
-        return getattr(obj, 'is_subscribed', False)
-
-
 class LightsRecipeSerializer(serializers.ModelSerializer):
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time',)
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time',)
 
 
 class UserGetSerializer(serializers.ModelSerializer):
@@ -64,6 +58,8 @@ class UserGetSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return Follow.objects.filter(
             user=self.context['request'].user,
             author=obj).exists()
@@ -96,11 +92,13 @@ class SubscriptionGetSerializer(UserGetSerializer):
         )
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+        return obj.recipes.count()
 
     def get_recipes(self, obj):
-        recipes_limit = int(
-            self.context['request'].query_params['recipes_limit']
-        )
-        recipes = Recipe.objects.all()[:recipes_limit]
+        if hasattr(obj, 'preview_recipes'):
+            recipes = obj.preview_recipes
+        else:
+            recipes = obj.recipes.all()
         return LightsRecipeSerializer(recipes, many=True, read_only=True).data
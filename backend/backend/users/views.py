@@ -1,12 +1,18 @@
+from django.db import transaction
+from django.db.models import (
+    BooleanField, Count, Exists, OuterRef, Prefetch, Subquery, Value
+)
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from djoser.serializers import SetPasswordSerializer
 from djoser.views import UserViewSet
 
+from core.pagination import LimitPageNumberPagination
+from core.timeline import backfill_timeline, remove_from_timeline
+from recipes.models import Recipe
 from .models import User, Follow
 from .serializers import (
     UserProfileSerializer,
@@ -20,8 +26,16 @@ class UserViewset(UserViewSet):
     queryset = User.objects.all()
     permission_classes = (AllowAny, )
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        return queryset
+
     def get_serializer_class(self):
-        print(self.action)
         if self.action == 'set_password':
             return SetPasswordSerializer
         if self.action == 'create':
@@ -39,14 +53,38 @@ class UserViewset(UserViewSet):
         serializers = self.get_serializer(me)
         return Response(serializers.data, status=status.HTTP_200_OK)
 
+    @staticmethod
+    def _preview_recipes(recipes_limit):
+        """Последние recipes_limit рецептов каждого автора одним запросом."""
+        recipes = Recipe.objects.all()
+        try:
+            recipes_limit = int(recipes_limit)
+        except (TypeError, ValueError):
+            return recipes
+        latest = Recipe.objects.filter(
+            author=OuterRef('author')
+        ).values('id')[:max(recipes_limit, 0)]
+        return recipes.filter(id__in=Subquery(latest))
+
     @action(
         detail=False,
         url_path='subscriptions',
         permission_classes=(IsAuthenticated, ),
-        pagination_class=PageNumberPagination
+        pagination_class=LimitPageNumberPagination
     )
     def subscriptions(self, request):
-        user_subscriptions = User.objects.filter(following__user=request.user)
+        user_subscriptions = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            recipes_count=Count('recipes'),
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).prefetch_related(Prefetch(
+            'recipes',
+            queryset=self._preview_recipes(
+                request.query_params.get('recipes_limit')
+            ),
+            to_attr='preview_recipes'
+        ))
         page = self.paginate_queryset(user_subscriptions)
         serializer = SubscriptionGetSerializer(
             page,
@@ -68,7 +106,9 @@ class UserViewset(UserViewSet):
             if not Follow.objects.filter(
                     user=follower,
                     author=following).exists():
-                Follow.objects.create(user=follower, author=following)
+                with transaction.atomic():
+                    Follow.objects.create(user=follower, author=following)
+                    backfill_timeline(follower, following)
                 serializer = UserGetSerializer(
                     following,
                     context={'request': request}
@@ -79,5 +119,7 @@ class UserViewset(UserViewSet):
                 )
             return Response(status=status.HTTP_400_BAD_REQUEST)
         subscr = get_object_or_404(Follow, user=follower, author=following)
-        subscr.delete()
+        with transaction.atomic():
+            subscr.delete()
+            remove_from_timeline(follower, following)
         return Response(status=status.HTTP_204_NO_CONTENT)